@@ -0,0 +1,100 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class SingleFlight:
+    """
+    Share one in-flight call among concurrent callers with the same key.
+    The first caller starts the work; callers arriving before it finishes await
+    the same task. Nothing is cached once the call completes.
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+
+            def _forget(done: "asyncio.Task[Any]") -> None:
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            task.add_done_callback(_forget)
+        # shield: one caller being cancelled must not cancel the shared call.
+        return await asyncio.shield(task)
+
+
+class MicroBatcher(Generic[R]):
+    """
+    Collect distinct items submitted within `window` seconds into one call of
+    `fn(items) -> results` (results in item order). A batch is sent early once
+    it reaches `max_batch` items. Duplicate items in a window share a result.
+
+    Pending futures and the flush timer belong to the event loop that created
+    them; if the batcher is used from a different loop, that state is dropped.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[str]], Awaitable[List[R]]],
+        window: float,
+        max_batch: int,
+    ) -> None:
+        self._fn = fn
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, "asyncio.Future[R]"] = {}
+        self._timer: Optional["asyncio.TimerHandle"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def submit(self, item: str) -> R:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # State left behind by a previous (possibly closed) loop can never
+            # resolve here; start over on this one.
+            self._loop = loop
+            self._pending = {}
+            self._timer = None
+        future = self._pending.get(item)
+        if future is None:
+            future = loop.create_future()
+            self._pending[item] = future
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[str, "asyncio.Future[R]"]) -> None:
+        items = list(batch)
+        try:
+            results = await self._fn(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch call returned {len(results)} results for {len(items)} items")
+        except BaseException as exc:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+            return
+        for item, result in zip(items, results):
+            if not batch[item].done():
+                batch[item].set_result(result)
@@ -0,0 +1,332 @@
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np  # type: ignore[import-not-found]
+
+
+def fit_projection(sample: np.ndarray, dim: int, method: str = "pca", seed: int = 0) -> np.ndarray:
+    """
+    A (full_dim x dim) matrix mapping unit embeddings to `dim` dimensions.
+    "pca" keeps the top right-singular vectors of `sample` (uncentred, so inner
+    products are what is preserved); "random" is a Gaussian Johnson-Lindenstrauss map.
+    """
+    full_dim = sample.shape[1]
+    dim = min(dim, full_dim)
+    if method == "random":
+        rng = np.random.default_rng(seed)
+        return (rng.standard_normal((full_dim, dim)) / np.sqrt(dim)).astype(np.float32)
+    if method != "pca":
+        raise ValueError(f"Unknown projection method {method!r}")
+    _, _, vt = np.linalg.svd(sample.astype(np.float32), full_matrices=False)
+    basis = np.zeros((full_dim, dim), dtype=np.float32)
+    basis[:, : min(dim, vt.shape[0])] = vt[:dim].T
+    return basis
+
+
+class EmbeddingIndex:
+    """
+    Row-normalised embedding matrix kept in step with the store's chunk list.
+    Row i holds the unit vector of chunk i, so cosine similarity is a single mat-vec.
+    Capacity grows geometrically, so appending a batch is amortised O(batch).
+    Deleted rows are tombstoned in an alive mask and only dropped by compact().
+    Each row also carries a label (the store uses the chunk's source), stored as
+    an integer code so label_mask() is a single vectorised comparison.
+
+    With a projection installed, a reduced copy of every row is kept as well:
+    top_k() scores all rows in the reduced space and re-ranks a shortlist with
+    the full vectors.
+    """
+
+    def __init__(self, dim: int = 0):
+        self.dim = dim
+        self._size = 0
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._labels = np.zeros(0, dtype=np.int32)
+        self._label_codes: Dict[str, int] = {}
+        self.dead = 0
+        self.projection: Optional[np.ndarray] = None
+        self._reduced = np.zeros((0, 0), dtype=np.float32)
+        # Rows present when the projection was fitted, to decide when to refit.
+        self.fitted_rows = 0
+        # Bumped whenever existing rows move, so a background fit can detect it.
+        self.version = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[: self._size]
+
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[: self._size]
+
+    def check(self, embeddings: Sequence[Sequence[float]]) -> None:
+        """Raise ValueError if the batch cannot be appended; never mutates."""
+        dim = self.dim
+        for emb in embeddings:
+            if not emb:
+                continue
+            if dim and len(emb) != dim:
+                raise ValueError(f"Embedding has dimension {len(emb)}, expected {dim}")
+            dim = len(emb)
+
+    def add(self, embeddings: Sequence[Sequence[float]], labels: Optional[Sequence[str]] = None) -> None:
+        """Append a batch of embeddings (one matrix write per batch) and their labels."""
+        if not embeddings:
+            return
+        self.check(embeddings)
+        if not self.dim:
+            self.dim = next((len(e) for e in embeddings if e), 0)
+            self._matrix = np.zeros((0, self.dim), dtype=np.float32)
+
+        rows = np.zeros((len(embeddings), self.dim), dtype=np.float32)
+        for i, emb in enumerate(embeddings):
+            if emb:
+                rows[i] = emb
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        np.divide(rows, norms, out=rows, where=norms > 0)
+
+        needed = self._size + len(rows)
+        if needed > self._matrix.shape[0]:
+            grown = np.zeros((max(needed, 2 * self._matrix.shape[0]), self.dim), dtype=np.float32)
+            grown[: self._size] = self._matrix[: self._size]
+            self._matrix = grown
+            alive = np.zeros(grown.shape[0], dtype=bool)
+            alive[: self._size] = self._alive[: self._size]
+            self._alive = alive
+            self._labels = _grow(self._labels[: self._size], grown.shape[0])
+            if self.projection is not None:
+                reduced = np.zeros((grown.shape[0], self.projection.shape[1]), dtype=np.float32)
+                reduced[: self._size] = self._reduced[: self._size]
+                self._reduced = reduced
+        self._matrix[self._size:needed] = rows
+        self._alive[self._size:needed] = True
+        self._labels[self._size:needed] = [self._label_code(label) for label in labels or [""] * len(rows)]
+        if self.projection is not None:
+            self._reduced[self._size:needed] = rows @ self.projection
+        self._size = needed
+
+    def truncate(self, size: int) -> None:
+        """Drop rows past `size` (used to roll back a failed batch)."""
+        if size < self._size:
+            self.dead -= int(np.count_nonzero(~self._alive[size:self._size]))
+            self._size = size
+            self.version += 1
+
+    def delete(self, rows: Sequence[int]) -> None:
+        """Tombstone rows; they stop matching but keep their slot until compact()."""
+        rows = [r for r in rows if self._alive[r]]
+        self._alive[rows] = False
+        self.dead += len(rows)
+
+    def restore(self, rows: Sequence[int]) -> None:
+        """Undo delete() for rows that were tombstoned by a failed operation."""
+        rows = [r for r in rows if not self._alive[r]]
+        self._alive[rows] = True
+        self.dead -= len(rows)
+
+    def _label_code(self, label: str) -> int:
+        return self._label_codes.setdefault(label, len(self._label_codes))
+
+    def set_label(self, rows: Sequence[int], label: str) -> None:
+        self._labels[list(rows)] = self._label_code(label)
+
+    def label_mask(self, labels: Sequence[str]) -> np.ndarray:
+        """Boolean mask of the rows whose label is one of `labels`."""
+        codes = [self._label_codes[label] for label in labels if label in self._label_codes]
+        return np.isin(self._labels[: self._size], codes)
+
+    def compact(self) -> np.ndarray:
+        """Drop tombstoned rows in place. Returns the old row numbers that survived."""
+        kept = np.flatnonzero(self.alive)
+        self._matrix = self._matrix[kept].copy()
+        if self.projection is not None:
+            self._reduced = self._reduced[kept].copy()
+        self._alive = np.ones(len(kept), dtype=bool)
+        self._labels = self._labels[kept].copy()
+        self._size = len(kept)
+        self.dead = 0
+        self.fitted_rows = min(self.fitted_rows, self._size)
+        self.version += 1
+        return kept
+
+    def needs_refit(self, min_rows: int, growth: float) -> bool:
+        """True once there are min_rows live rows and the index grew by `growth` since the last fit."""
+        live = self._size - self.dead
+        if live < min_rows:
+            return False
+        return self.projection is None or self._size >= self.fitted_rows * (1 + growth)
+
+    def install_projection(
+        self,
+        projection: np.ndarray,
+        reduced: np.ndarray,
+        size: int,
+        version: int,
+    ) -> bool:
+        """
+        Switch to `projection`, given the reduced form of the first `size` rows
+        computed off-thread at `version`. Rows added since are projected here.
+        Returns False (and changes nothing) if rows were moved in the meantime.
+        """
+        if version != self.version or size > self._size:
+            return False
+        full = np.zeros((self._matrix.shape[0], projection.shape[1]), dtype=np.float32)
+        full[:size] = reduced
+        full[size:self._size] = self._matrix[size:self._size] @ projection
+        self.projection = projection
+        self._reduced = full
+        self.fitted_rows = self._size
+        return True
+
+    def scores(self, query: Sequence[float]) -> np.ndarray:
+        """Cosine similarity of `query` against every row."""
+        if not self._size or not query or len(query) != self.dim:
+            return np.zeros(self._size, dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return np.zeros(self._size, dtype=np.float32)
+        return self.matrix @ (q / norm)
+
+    def top_k_among(self, query: Sequence[float], rows: Sequence[int], k: int) -> List[Tuple[int, float]]:
+        """Like top_k(), but only `rows` are scored."""
+        if not len(rows) or not query or len(query) != self.dim:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        rows = np.asarray(rows, dtype=np.int64)
+        exact = self._matrix[rows] @ (q / norm)
+        return [(int(rows[i]), float(exact[i])) for i in top_k_indices(exact, k)]
+
+    def top_k(
+        self,
+        query: Sequence[float],
+        k: int,
+        mask: Optional[np.ndarray] = None,
+        rerank_factor: int = 8,
+    ) -> List[Tuple[int, float]]:
+        """
+        The k best (row, cosine score) pairs, best first. With a projection, rows
+        are shortlisted by their reduced score (k * rerank_factor of them) and only
+        the shortlist is scored with the full vectors.
+        """
+        if self.projection is None or not self._size or not query or len(query) != self.dim:
+            scores = self.scores(query)
+            return [(i, float(scores[i])) for i in top_k_indices(scores, k, mask)]
+        q = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        q = q / norm
+        coarse = self._reduced[: self._size] @ (q @ self.projection)
+        shortlist = np.asarray(top_k_indices(coarse, k * max(rerank_factor, 1), mask), dtype=np.int64)
+        if not len(shortlist):
+            return []
+        exact = self._matrix[shortlist] @ q
+        order = top_k_indices(exact, k)
+        return [(int(shortlist[i]), float(exact[i])) for i in order]
+
+
+def top_k_indices(scores: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> List[int]:
+    """Indices of the k highest scores (restricted to `mask`), best first."""
+    candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(scores))
+    if k <= 0 or not len(candidates):
+        return []
+    sub = scores[candidates]
+    if k < len(candidates):
+        part = np.argpartition(-sub, k - 1)[:k]
+    else:
+        part = np.arange(len(candidates))
+    order = part[np.argsort(-sub[part], kind="stable")]
+    return candidates[order].tolist()
+
+
+class DocumentCentroids:
+    """
+    One routing vector per document: the sum of its live chunks' unit vectors,
+    updated as chunks are added or tombstoned, so the centroid never has to be
+    recomputed from scratch. A document may also carry a summary vector; it is
+    scored alongside the centroid and the better of the two counts.
+    """
+
+    def __init__(self, dim: int = 0):
+        self.dim = dim
+        self.keys: List[Hashable] = []
+        # Free-form per-document label (the store keeps the document's source here).
+        self.labels: List[str] = []
+        self._slot: Dict[Hashable, int] = {}
+        self._sums = np.zeros((0, dim), dtype=np.float32)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._summaries = np.zeros((0, dim), dtype=np.float32)
+        self._has_summary = np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def slot(self, key: Hashable) -> int:
+        slot = self._slot.get(key)
+        if slot is None:
+            slot = self._slot[key] = len(self.keys)
+            self.keys.append(key)
+            self.labels.append("")
+            if slot >= len(self._counts):
+                capacity = max(slot + 1, 2 * len(self._counts))
+                self._sums = _grow(self._sums, capacity)
+                self._summaries = _grow(self._summaries, capacity)
+                self._counts = _grow(self._counts, capacity)
+                self._has_summary = _grow(self._has_summary, capacity)
+        return slot
+
+    def update(self, keys: Sequence[Hashable], vectors: np.ndarray, sign: int = 1) -> None:
+        """Add (sign=1) or remove (sign=-1) unit chunk vectors from their documents."""
+        if not len(keys):
+            return
+        if not self.dim:
+            self.dim = vectors.shape[1]
+            self._sums = np.zeros((len(self._counts), self.dim), dtype=np.float32)
+            self._summaries = np.zeros((len(self._counts), self.dim), dtype=np.float32)
+        slots = np.fromiter((self.slot(key) for key in keys), dtype=np.int64, count=len(keys))
+        np.add.at(self._sums, slots, sign * vectors)
+        np.add.at(self._counts, slots, sign)
+
+    def set_label(self, key: Hashable, label: str) -> None:
+        self.labels[self.slot(key)] = label
+
+    def set_summary(self, key: Hashable, vector: Optional[Sequence[float]]) -> None:
+        slot = self.slot(key)
+        if vector is None or len(vector) != self.dim:
+            self._has_summary[slot] = False
+            return
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        self._summaries[slot] = v / norm if norm else v
+        self._has_summary[slot] = norm > 0
+
+    def top(self, query: Sequence[float], n: int, allowed: Optional[np.ndarray] = None) -> List[Hashable]:
+        """Keys of the n documents most similar to `query`, among those with live chunks."""
+        size = len(self.keys)
+        if not size or not query or len(query) != self.dim:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        sums = self._sums[:size]
+        norms = np.linalg.norm(sums, axis=1)
+        scores = np.divide(sums @ q, norms, out=np.full(size, -np.inf, dtype=np.float32), where=norms > 0)
+        has_summary = self._has_summary[:size]
+        if has_summary.any():
+            rows = np.flatnonzero(has_summary)
+            scores[rows] = np.maximum(scores[rows], self._summaries[rows] @ q)
+        mask = self._counts[:size] > 0
+        if allowed is not None:
+            mask &= allowed
+        return [self.keys[i] for i in top_k_indices(scores, n, mask)]
+
+
+def _grow(array: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
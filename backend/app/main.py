@@ -1,20 +1,30 @@
-import io
 import logging
+import os
+import tempfile
+from typing import IO, Iterator, List, Optional
+from uuid import UUID, uuid4
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException  # type: ignore[import-not-found]
+from fastapi import (  # type: ignore[import-not-found]
+    BackgroundTasks, FastAPI, UploadFile, File, Form, HTTPException, Query,
+)
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore[import-not-found]
 from pypdf import PdfReader  # type: ignore[import-not-found]
 
 from .models import (
-    UploadTextRequest, WikiImportRequest,
-    ChatRequest, ChatResponse, FeedbackRequest, StatsResponse,
+    UploadTextRequest, UploadBulkRequest, UploadBulkResponse, UploadedDocument,
+    DocumentInfo, DocumentUpdateResponse, WikiImportRequest,
+    ChatRequest, ChatResponse, FeedbackRequest, StatsResponse, AnalyticsResponse,
     RetrievedChunk, ChunkMetadata
 )
-from . import rag, wiki, store
+from . import rag, scheduler, sessions, wiki, store
 
 
 logger = logging.getLogger(__name__)
 
+# Uploads are spooled to disk in UPLOAD_CHUNK_BYTES pieces and rejected past this size.
+MAX_UPLOAD_BYTES = int(float(os.getenv("STUDYBUDDY_MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
 app = FastAPI()
 
 # Add CORS middleware
@@ -34,39 +44,159 @@ async def health_check():
 
 
 @app.post("/api/upload-text")
-async def upload_text(req: UploadTextRequest):
-    await rag.store_text(req.title, req.text, req.source)
-    return {"status": "ok"}
+async def upload_text(req: UploadTextRequest, background_tasks: BackgroundTasks):
+    doc_id = uuid4()
+    await rag.store_text(req.title, req.text, req.source, doc_id=doc_id, collection=req.collection)
+    background_tasks.add_task(store.refit_projection, req.collection)
+    if rag.DOC_SUMMARIES:
+        background_tasks.add_task(rag.summarize_document, doc_id, req.collection)
+    return {"status": "ok", "doc_id": str(doc_id)}
 
 
-@app.post("/api/upload-pdf")
-async def upload_pdf(title: str = Form(...), file: UploadFile = File(...)):
+@app.post("/api/upload-bulk", response_model=UploadBulkResponse)
+async def upload_bulk(req: UploadBulkRequest, background_tasks: BackgroundTasks):
     """
-    Accept a PDF file upload, extract text, and store it as a 'user' document.
+    Store many text documents in one request. All chunks are embedded in batches
+    and committed to the store atomically with a single flush.
     """
-    if file.content_type not in ("application/pdf", "application/x-pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    documents = [{**doc.model_dump(), "doc_id": uuid4()} for doc in req.documents]
+    chunk_ids = await rag.store_texts(documents)
+    for collection in {doc["collection"] for doc in documents}:
+        background_tasks.add_task(store.refit_projection, collection)
+    if rag.DOC_SUMMARIES:
+        for doc in documents:
+            background_tasks.add_task(rag.summarize_document, doc["doc_id"], doc["collection"])
+    return UploadBulkResponse(
+        status="ok",
+        documents=[
+            UploadedDocument(doc_id=doc["doc_id"], title=doc["title"], chunk_ids=ids)
+            for doc, ids in zip(documents, chunk_ids)
+        ],
+    )
+
 
-    raw_bytes = await file.read()
-    reader = PdfReader(io.BytesIO(raw_bytes))
-    pages_text = []
+async def _spool_upload(file: UploadFile, dest: IO[bytes]) -> int:
+    """Copy an upload to `dest` piece by piece, enforcing MAX_UPLOAD_BYTES."""
+    size = 0
+    while True:
+        piece = await file.read(UPLOAD_CHUNK_BYTES)
+        if not piece:
+            break
+        size += len(piece)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File is larger than the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit",
+            )
+        dest.write(piece)
+    dest.seek(0)
+    return size
+
+
+def _iter_pdf_pages(reader: PdfReader) -> Iterator[str]:
     for page in reader.pages:
         try:
-            pages_text.append(page.extract_text() or "")
+            yield page.extract_text() or ""
         except Exception:
             continue
-    full_text = "\n\n".join(pages_text)
 
-    if not full_text.strip():
+
+@app.post("/api/upload-pdf")
+async def upload_pdf(
+    background_tasks: BackgroundTasks,
+    title: str = Form(...),
+    file: UploadFile = File(...),
+    collection: Optional[str] = Form(None, pattern=store.COLLECTION_NAME_PATTERN),
+):
+    """
+    Accept a PDF file upload, extract text, and store it as a 'user' document.
+    The upload is spooled to a temporary file and its pages are read from disk and
+    chunked one at a time, so a large PDF is never held in memory as a whole.
+    """
+    if file.content_type not in ("application/pdf", "application/x-pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    doc_id = uuid4()
+    with tempfile.TemporaryFile(suffix=".pdf") as spooled:
+        size = await _spool_upload(file, spooled)
+        reader = PdfReader(spooled)
+        chunk_ids = await rag.store_pages(
+            title=title,
+            pages=_iter_pdf_pages(reader),
+            source="user",
+            doc_id=doc_id,
+            collection=collection,
+        )
+
+    if not chunk_ids:
         raise HTTPException(status_code=400, detail="Could not extract text from PDF")
+    background_tasks.add_task(store.refit_projection, collection)
+    if rag.DOC_SUMMARIES:
+        background_tasks.add_task(rag.summarize_document, doc_id, collection)
+
+    logger.info("Stored PDF '%s' (%d bytes) as %d chunk(s)", title, size, len(chunk_ids))
+    return {"status": "ok", "doc_id": str(doc_id)}
+
 
-    logger.info(
-        "Storing PDF '%s' with %d extracted characters",
-        title,
-        len(full_text),
+async def _compact_store(collection: Optional[str] = None):
+    reclaimed = store.maybe_compact(collection)
+    if reclaimed:
+        logger.info("Compacted store, reclaimed %d tombstoned chunk(s)", reclaimed)
+
+
+@app.get("/api/documents", response_model=List[DocumentInfo])
+async def list_documents(
+    collection: Optional[str] = Query(None, pattern=store.COLLECTION_NAME_PATTERN),
+):
+    return [DocumentInfo(**doc) for doc in store.list_documents(collection)]
+
+
+@app.delete("/api/documents/{doc_id}")
+async def delete_document(
+    doc_id: UUID,
+    background_tasks: BackgroundTasks,
+    collection: Optional[str] = Query(None, pattern=store.COLLECTION_NAME_PATTERN),
+):
+    """
+    Remove a document. Its chunks are tombstoned immediately and the index is
+    compacted in the background once enough tombstones accumulate.
+    """
+    removed = store.delete_document(doc_id, collection)
+    if not removed:
+        raise HTTPException(status_code=404, detail="Document not found")
+    background_tasks.add_task(_compact_store, collection)
+    return {"status": "ok", "doc_id": str(doc_id), "removed_chunks": removed}
+
+
+@app.put("/api/documents/{doc_id}", response_model=DocumentUpdateResponse)
+async def update_document(
+    doc_id: UUID,
+    req: UploadTextRequest,
+    background_tasks: BackgroundTasks,
+    collection: Optional[str] = Query(None, pattern=store.COLLECTION_NAME_PATTERN),
+):
+    """
+    Replace a document's content. Only chunks whose text changed are re-embedded.
+    The document is looked up in the ?collection= query parameter, like the other
+    document endpoints; req.collection is accepted too if it does not conflict.
+    """
+    if collection and req.collection and collection != req.collection:
+        raise HTTPException(status_code=400, detail="Conflicting collection in query and body")
+    collection = collection or req.collection
+    if not store.get_document(doc_id, collection):
+        raise HTTPException(status_code=404, detail="Document not found")
+    chunk_ids, reembedded = await rag.update_document(
+        doc_id, req.title, req.text, req.source, collection=collection,
+    )
+    background_tasks.add_task(_compact_store, collection)
+    if rag.DOC_SUMMARIES:
+        background_tasks.add_task(rag.summarize_document, doc_id, collection)
+    return DocumentUpdateResponse(
+        status="ok",
+        doc_id=doc_id,
+        chunk_ids=chunk_ids,
+        reembedded=reembedded,
     )
-    await rag.store_text(title=title, text=full_text, source="user")
-    return {"status": "ok"}
 
 
 @app.post("/api/import-wiki")
@@ -76,13 +206,27 @@ async def import_wiki(req: WikiImportRequest):
 
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest):
-    store.increment_questions_count()
-    answer, top_scored = await rag.rag_answer(
-        question=req.question,
-        top_k=req.top_k,
-        sources=req.sources,
-    )
+async def chat(req: ChatRequest, background_tasks: BackgroundTasks):
+    # Also covers corpora loaded from disk, which no upload has triggered a fit for.
+    background_tasks.add_task(store.refit_projection, req.collection)
+    top_scored = []
+    try:
+        session = None
+        if req.session_id is not None:
+            session = sessions.get_session(req.session_id, req.collection, req.sources)
+        answer, top_scored = await rag.rag_answer(
+            question=req.question,
+            top_k=req.top_k,
+            sources=req.sources,
+            collection=req.collection,
+            session=session,
+            min_score=req.min_score,
+            max_score_gap=req.max_score_gap,
+            answer_without_context=req.answer_without_context,
+        )
+    finally:
+        # One analytics write per question, counted even if answering fails.
+        store.increment_questions_count(req.collection, (d for _, d in top_scored))
     context = [
         RetrievedChunk(
             id=d.id,
@@ -93,7 +237,15 @@ async def chat(req: ChatRequest):
         )
         for score, d in top_scored
     ]
-    return ChatResponse(answer=answer, context=context)
+    return ChatResponse(answer=answer, context=context, session_id=req.session_id)
+
+
+@app.delete("/api/sessions/{session_id}")
+async def end_session(session_id: UUID):
+    """Forget a conversation's server-side state."""
+    if not sessions.end_session(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"status": "ok"}
 
 
 @app.post("/api/feedback")
@@ -107,8 +259,25 @@ async def feedback(req: FeedbackRequest):
     return {"status": "ok"}
 
 
+@app.get("/api/metrics/upstream")
+async def upstream_metrics():
+    """Queue depth, admissions, load-shedding and queue-time percentiles per priority class."""
+    return scheduler.upstream.metrics()
+
+
+@app.get("/api/metrics/retrieval")
+async def retrieval_metrics():
+    """How many answers used every retrieved chunk, a score-trimmed subset, or no LLM call."""
+    return {path: rag.retrieval_paths[path] for path in ("full", "trimmed", "no_context")}
+
+
 @app.get("/api/stats", response_model=StatsResponse)
 async def stats():
     stats_dict = store.get_stats()
     return StatsResponse(**stats_dict)
 
+
+@app.get("/api/analytics", response_model=AnalyticsResponse)
+async def analytics():
+    """Questions and feedback per time bucket, and the most cited documents."""
+    return AnalyticsResponse(**store.get_analytics())
@@ -1,12 +1,47 @@
-from pydantic import BaseModel
+from datetime import datetime
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from uuid import UUID
 
+from .store import COLLECTION_NAME_PATTERN
+
 
 class UploadTextRequest(BaseModel):
     title: str
     text: str
     source: str = "user"  # "user" or "wikipedia"
+    collection: Optional[str] = Field(default=None, pattern=COLLECTION_NAME_PATTERN)
+
+
+class UploadBulkRequest(BaseModel):
+    documents: List[UploadTextRequest]
+
+
+class UploadedDocument(BaseModel):
+    doc_id: UUID
+    title: str
+    chunk_ids: List[UUID]
+
+
+class UploadBulkResponse(BaseModel):
+    status: str
+    documents: List[UploadedDocument]
+
+
+class DocumentInfo(BaseModel):
+    doc_id: UUID
+    title: str
+    source: str
+    url: Optional[str] = None
+    chunks: int
+    summary: Optional[str] = None
+
+
+class DocumentUpdateResponse(BaseModel):
+    status: str
+    doc_id: UUID
+    chunk_ids: List[UUID]
+    reembedded: int  # chunks whose content changed and were sent for embedding
 
 
 class WikiImportRequest(BaseModel):
@@ -17,6 +52,14 @@ class ChatRequest(BaseModel):
     question: str
     top_k: int = 3
     sources: Optional[List[str]] = None  # ["user", "wikipedia"]
+    collection: Optional[str] = Field(default=None, pattern=COLLECTION_NAME_PATTERN)
+    # Client-chosen conversation id; follow-ups reuse earlier retrieval and history.
+    session_id: Optional[UUID] = None
+    # Context trimming; omitted values use the server defaults.
+    min_score: Optional[float] = Field(default=None, ge=-1.0, le=1.0)
+    max_score_gap: Optional[float] = Field(default=None, ge=0.0, le=2.0)
+    # Ask the LLM even when no chunk is relevant, instead of the canned "don't know".
+    answer_without_context: bool = False
 
 
 class ChunkMetadata(BaseModel):
@@ -35,6 +78,7 @@ class RetrievedChunk(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     context: List[RetrievedChunk]
+    session_id: Optional[UUID] = None
 
 
 class FeedbackRequest(BaseModel):
@@ -44,9 +88,38 @@ class FeedbackRequest(BaseModel):
     comment: Optional[str] = None
 
 
+class CollectionStats(BaseModel):
+    name: str
+    documents: int
+    chunks: int
+    questions: int
+    loaded: bool  # currently resident in memory
+
+
 class StatsResponse(BaseModel):
     total_questions: int
     total_feedback: int
     positive_feedback: int
     negative_feedback: int
+    collections: List[CollectionStats] = []
+
+
+class AnalyticsBucket(BaseModel):
+    start: datetime  # bucket start, UTC
+    questions: int
+    feedback: int
+    positive: int
+    negative: int
+
+
+class DocumentCitations(BaseModel):
+    doc_id: UUID
+    title: str
+    collection: str
+    citations: int  # questions this document was retrieved for
+
 
+class AnalyticsResponse(BaseModel):
+    bucket_seconds: int
+    buckets: List[AnalyticsBucket] = []
+    top_documents: List[DocumentCitations] = []
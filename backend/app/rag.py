@@ -1,14 +1,24 @@
+import itertools
+import json
 import logging
 import math
 import os
-from typing import List, Optional
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
 
 import httpx  # type: ignore[import-not-found]  # or mistral SDK
 import wikipedia  # type: ignore[import-not-found]
 from dotenv import load_dotenv  # type: ignore[import-not-found]
 from fastapi import HTTPException  # type: ignore[import-not-found]
 
-from .store import add_doc_chunk, get_docs
+from .coalesce import MicroBatcher, SingleFlight
+from .scheduler import Priority, upstream
+from .sessions import Session
+from .store import (
+    DocChunk, add_doc_chunks, content_hash, delete_document, flush, get_docs, get_document,
+    live_chunk_ids, replace_document, search, set_document_summary,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -25,25 +35,53 @@ CHAT_MODEL = "mistral-small-latest"
 AUTO_WIKI_ARTICLES = int(os.getenv("AUTO_WIKI_ARTICLES", "0"))
 # Limit how many chunks we embed per document to avoid rate limits.
 MAX_DOC_CHUNKS = int(os.getenv("MAX_DOC_CHUNKS", "10"))
+# Max texts sent per embeddings request when ingesting several documents at once.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+# Concurrent query embeddings arriving within this window share one request.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+# Retrieved chunks scoring below RETRIEVAL_MIN_SCORE, or more than RETRIEVAL_SCORE_GAP
+# below the best chunk, are left out of the prompt (0 disables the gap cutoff).
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0"))
+RETRIEVAL_SCORE_GAP = float(os.getenv("RETRIEVAL_SCORE_GAP", "0"))
+# Generate a short LLM summary per uploaded document to route coarse search.
+# Off by default: it costs one chat call per document.
+DOC_SUMMARIES = os.getenv("STUDYBUDDY_DOC_SUMMARIES", "0") == "1"
+# Characters of a document's opening chunks the summary is written from.
+SUMMARY_INPUT_CHARS = 4000
+# Returned without calling the LLM when no relevant context is left.
+NO_CONTEXT_ANSWER = (
+    "I don't know. I couldn't find anything relevant to this question in your study materials."
+)
 
 
 def split_into_chunks(text: str, max_chars: int = 500) -> List[str]:
     # super simple split by paragraphs or fixed size
-    chunks = []
-    current = []
+    return list(iter_chunks(text.split("\n"), max_chars))
+
+
+def iter_chunks(lines: Iterable[str], max_chars: int = 500) -> Iterator[str]:
+    """split_into_chunks over lines that arrive lazily; only one chunk is held at a time."""
+    current: List[str] = []
     current_len = 0
 
-    for paragraph in text.split("\n"):
+    for paragraph in lines:
         if current_len + len(paragraph) > max_chars and current:
-            chunks.append("\n".join(current))
+            yield "\n".join(current)
             current = []
             current_len = 0
         current.append(paragraph)
         current_len += len(paragraph)
 
     if current:
-        chunks.append("\n".join(current))
-    return chunks
+        yield "\n".join(current)
+
+
+def _page_lines(pages: Iterable[str]) -> Iterator[str]:
+    # Same lines as "\n\n".join(pages).split("\n"), without building the joined text.
+    for number, page in enumerate(pages):
+        if number:
+            yield ""
+        yield from page.split("\n")
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -55,7 +93,15 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
     return dot / (na * nb)
 
 
-async def _post_embeddings(inputs: List[str]) -> List[List[float]]:
+async def _post(url: str, headers: Dict[str, str], payload: Dict) -> httpx.Response:
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        return await client.post(url, headers=headers, json=payload)
+
+
+async def _post_embeddings(
+    inputs: List[str],
+    priority: Priority = Priority.BULK,
+) -> List[List[float]]:
     if not inputs:
         return []
 
@@ -74,12 +120,11 @@ async def _post_embeddings(inputs: List[str]) -> List[List[float]]:
 
     logger.debug("Requesting embeddings for %d chunk(s)", len(inputs))
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            f"{MISTRAL_BASE_URL}/embeddings",
-            headers=headers,
-            json=payload,
-        )
+    # All upstream calls go through the scheduler so ingestion cannot starve chats.
+    resp = await upstream.run(
+        priority,
+        lambda: _post(f"{MISTRAL_BASE_URL}/embeddings", headers, payload),
+    )
 
     if resp.status_code == 429:
         logger.warning("Mistral rate limit reached: %s", resp.text)
@@ -93,43 +138,59 @@ async def _post_embeddings(inputs: List[str]) -> List[List[float]]:
     return [item["embedding"] for item in data["data"]]
 
 
+# Identical concurrent upstream calls share one request (keyed on the payload),
+# and distinct query embeddings are micro-batched into one _post_embeddings call.
+_single_flight = SingleFlight()
+_query_batcher: MicroBatcher[List[float]] = MicroBatcher(
+    lambda texts: _post_embeddings(texts, priority=Priority.QUERY),
+    window=EMBED_BATCH_WINDOW_MS / 1000,
+    max_batch=EMBED_BATCH_SIZE,
+)
+
+
 async def get_embedding(text: str) -> List[float]:
     """
     Convenience wrapper to fetch a single embedding.
+    Concurrent callers are coalesced: identical texts share one in-flight request and
+    distinct texts submitted within EMBED_BATCH_WINDOW_MS go out as one batch.
     """
-    embeddings = await _post_embeddings([text])
-    return embeddings[0] if embeddings else []
+    return await _single_flight.do(("embedding", text), lambda: _query_batcher.submit(text))
 
 
-async def get_embeddings(texts: List[str]) -> List[List[float]]:
+async def get_embeddings(
+    texts: List[str],
+    priority: Priority = Priority.BULK,
+) -> List[List[float]]:
     """
     Fetch embeddings for a batch of texts in one API call.
+    Scheduled at bulk priority unless a caller on the chat path says otherwise.
     """
-    return await _post_embeddings(texts)
+    return await _single_flight.do(
+        ("embeddings", tuple(texts)),
+        lambda: _post_embeddings(texts, priority=priority),
+    )
 
 
-async def call_mistral_chat(prompt: str) -> str:
-    """
-    Call Mistral's chat completions endpoint with a single user prompt.
-    Returns the assistant's text content.
-    """
-    if not MISTRAL_API_KEY:
-        raise RuntimeError("MISTRAL_API_KEY is not set")
+SYSTEM_PROMPT = (
+    "You are a helpful study assistant. "
+    "Use only the provided context when answering. "
+    "If the answer is not in the context, say you don't know."
+)
 
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-    }
 
+async def call_mistral_chat(prompt: str, history: Optional[List[Dict[str, str]]] = None) -> str:
+    """
+    Call Mistral's chat completions endpoint with a single user prompt, optionally
+    preceded by earlier user/assistant messages of the conversation.
+    Returns the assistant's text content. Identical concurrent requests share one
+    upstream call.
+    """
     messages = [
         {
             "role": "system",
-            "content": (
-                "You are a helpful study assistant. "
-                "Use only the provided context when answering. "
-                "If the answer is not in the context, say you don't know."
-            ),
+            "content": SYSTEM_PROMPT,
         },
+        *(history or []),
         {
             "role": "user",
             "content": prompt,
@@ -144,56 +205,281 @@ async def call_mistral_chat(prompt: str) -> str:
         "max_tokens": 512,
     }
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            f"{MISTRAL_BASE_URL}/chat/completions",
-            headers=headers,
-            json=payload,
-        )
-        resp.raise_for_status()
-        data = resp.json()
+    key = ("chat", json.dumps(payload, sort_keys=True))
+    return await _single_flight.do(key, lambda: _post_chat(payload))
+
+
+async def _post_chat(payload: Dict, priority: Priority = Priority.INTERACTIVE) -> str:
+    if not MISTRAL_API_KEY:
+        raise RuntimeError("MISTRAL_API_KEY is not set")
+
+    headers = {
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Content-Type": "application/json",
+    }
+
+    resp = await upstream.run(
+        priority,
+        lambda: _post(f"{MISTRAL_BASE_URL}/chat/completions", headers, payload),
+    )
+    resp.raise_for_status()
+    data = resp.json()
 
     # Response shape: {"choices": [{"message": {"role": "assistant", "content": "..."}, ...}], ...}
     content = data["choices"][0]["message"]["content"]
     return content
 
 
-
-async def store_text(title: str, text: str, source: str, max_chunks: Optional[int] = None):
+def _iter_doc_chunks(title: str, lines: Iterable[str], max_chunks: Optional[int] = None) -> Iterator[str]:
     """
-    Split text into chunks, embed, and store.
-    max_chunks can be used to cap how many chunks are embedded (helps avoid rate limits
-    for very long documents).
+    Chunk a document's lines, yielding at most max_chunks chunks. Lines are
+    consumed lazily and reading stops once the limit is reached.
     """
-    chunks = [c for c in split_into_chunks(text) if c.strip()]
+    chunks = (c for c in iter_chunks(lines) if c.strip())
     limit = max_chunks if max_chunks is not None else MAX_DOC_CHUNKS
-    if limit > 0 and len(chunks) > limit:
+    if limit <= 0:
+        yield from chunks
+        return
+    yield from itertools.islice(chunks, limit)
+    if next(chunks, None) is not None:
         logger.warning(
-            "Truncating document '%s' to %d chunks (out of %d) to respect MAX_DOC_CHUNKS",
+            "Truncating document '%s' to %d chunks to respect MAX_DOC_CHUNKS",
             title,
             limit,
-            len(chunks),
         )
-        chunks = chunks[:limit]
 
+
+def _prepare_chunks(title: str, lines: Iterable[str], max_chunks: Optional[int] = None) -> List[str]:
+    return list(_iter_doc_chunks(title, lines, max_chunks))
+
+
+def _batched(chunks: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def store_text(
+    title: str,
+    text: str,
+    source: str,
+    max_chunks: Optional[int] = None,
+    doc_id: Optional[UUID] = None,
+    collection: Optional[str] = None,
+    priority: Priority = Priority.BULK,
+):
+    """
+    Split text into chunks, embed, and store.
+    max_chunks can be used to cap how many chunks are embedded (helps avoid rate limits
+    for very long documents).
+    All chunks share doc_id (a new one if omitted) and go into `collection`
+    (the default collection if omitted). Returns the ids of the stored chunks.
+    """
+    chunks = _prepare_chunks(title, text.split("\n"), max_chunks)
+    return await _store_chunks(chunks, title, source, doc_id, collection, priority)
+
+
+async def store_pages(
+    title: str,
+    pages: Iterable[str],
+    source: str,
+    max_chunks: Optional[int] = None,
+    doc_id: Optional[UUID] = None,
+    collection: Optional[str] = None,
+):
+    """
+    store_text for text that arrives page by page, e.g. extracted from a PDF on disk.
+    Pages are chunked as they are read and are not pulled past the chunk limit.
+    Chunks are embedded and stored EMBED_BATCH_SIZE at a time, so neither the
+    document's text nor its full chunk list is ever held in memory, even uncapped.
+    The store is written once at the end; on failure the partly stored document
+    is deleted again, so `doc_id` (if given) must be a new document.
+    """
+    doc_id = doc_id or uuid4()
+    ids: List[UUID] = []
+    try:
+        for batch in _batched(_iter_doc_chunks(title, _page_lines(pages), max_chunks), EMBED_BATCH_SIZE):
+            embeddings = await get_embeddings(batch, priority=Priority.BULK)
+            stored = add_doc_chunks(
+                (
+                    {"text": chunk, "embedding": emb, "source": source, "title": title, "doc_id": doc_id}
+                    for chunk, emb in zip(batch, embeddings)
+                ),
+                collection=collection,
+                flush=False,
+            )
+            ids.extend(chunk.id for chunk in stored)
+        if ids:
+            flush(collection)
+    except Exception:
+        if ids:
+            delete_document(doc_id, collection)
+        raise
+    return ids
+
+
+async def _store_chunks(
+    chunks: List[str],
+    title: str,
+    source: str,
+    doc_id: Optional[UUID] = None,
+    collection: Optional[str] = None,
+    priority: Priority = Priority.BULK,
+) -> List[UUID]:
     if not chunks:
-        return
+        return []
 
-    embeddings = await get_embeddings(chunks)
+    embeddings = await get_embeddings(chunks, priority=priority)
 
-    for chunk, emb in zip(chunks, embeddings):
-        add_doc_chunk(chunk, emb, source=source, title=title)
+    doc_id = doc_id or uuid4()
+    stored = add_doc_chunks(
+        (
+            {"text": chunk, "embedding": emb, "source": source, "title": title, "doc_id": doc_id}
+            for chunk, emb in zip(chunks, embeddings)
+        ),
+        collection=collection,
+    )
+    return [chunk.id for chunk in stored]
 
 
-async def _ensure_wikipedia_context(question: str, max_new_articles: int = AUTO_WIKI_ARTICLES):
+async def store_texts(documents: List[Dict[str, str]], max_chunks: Optional[int] = None):
+    """
+    Bulk variant of store_text for many {"title", "text", "source"} documents,
+    each with an optional "doc_id" and "collection".
+    Chunks from all documents are embedded in EMBED_BATCH_SIZE requests and stored
+    in one atomic batch per collection. Returns the chunk ids for each document, in order.
+    """
+    doc_ids = [doc.get("doc_id") or uuid4() for doc in documents]
+    pending: List[Tuple[int, str]] = []
+    for doc_index, doc in enumerate(documents):
+        for chunk in _prepare_chunks(doc["title"], doc["text"].split("\n"), max_chunks):
+            pending.append((doc_index, chunk))
+
+    texts = [chunk for _, chunk in pending]
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        embeddings.extend(await get_embeddings(texts[start:start + EMBED_BATCH_SIZE]))
+
+    by_collection: Dict[Optional[str], List[Tuple[int, str, List[float]]]] = {}
+    for (doc_index, chunk), emb in zip(pending, embeddings):
+        name = documents[doc_index].get("collection")
+        by_collection.setdefault(name, []).append((doc_index, chunk, emb))
+
+    ids: List[List[UUID]] = [[] for _ in documents]
+    for name, rows in by_collection.items():
+        stored = add_doc_chunks(
+            (
+                {
+                    "text": chunk,
+                    "embedding": emb,
+                    "source": documents[doc_index]["source"],
+                    "title": documents[doc_index]["title"],
+                    "doc_id": doc_ids[doc_index],
+                }
+                for doc_index, chunk, emb in rows
+            ),
+            collection=name,
+        )
+        for (doc_index, _, _), chunk in zip(rows, stored):
+            ids[doc_index].append(chunk.id)
+    return ids
+
+
+async def update_document(
+    doc_id: UUID,
+    title: str,
+    text: str,
+    source: str,
+    max_chunks: Optional[int] = None,
+    collection: Optional[str] = None,
+):
+    """
+    Re-chunk a revised document and swap it in under the same doc_id.
+    Only chunks whose content hash is new are sent to the embeddings API; unchanged
+    chunks reuse their stored embedding. Returns (chunk ids, number re-embedded).
+    """
+    known = {chunk.content_hash: chunk.embedding for chunk in get_document(doc_id, collection)}
+    chunks = _prepare_chunks(title, text.split("\n"), max_chunks)
+    hashes = [content_hash(chunk) for chunk in chunks]
+
+    to_embed = list(dict.fromkeys(
+        chunk for chunk, digest in zip(chunks, hashes) if digest not in known
+    ))
+    embeddings: List[List[float]] = []
+    for start in range(0, len(to_embed), EMBED_BATCH_SIZE):
+        embeddings.extend(await get_embeddings(to_embed[start:start + EMBED_BATCH_SIZE]))
+    known.update((content_hash(chunk), emb) for chunk, emb in zip(to_embed, embeddings))
+
+    stored = replace_document(
+        doc_id,
+        (
+            {
+                "text": chunk,
+                "embedding": known[digest],
+                "source": source,
+                "title": title,
+                "content_hash": digest,
+            }
+            for chunk, digest in zip(chunks, hashes)
+        ),
+        collection=collection,
+    )
+    return [chunk.id for chunk in stored], len(to_embed)
+
+
+async def summarize_document(doc_id: UUID, collection: Optional[str] = None) -> Optional[str]:
+    """
+    Write a short summary of a document from its opening chunks and store it with
+    its embedding. Both calls run at bulk priority so they never delay a chat.
+    Meant for background tasks: failures are logged and return None.
+    """
+    chunks = get_document(doc_id, collection)
+    if not chunks:
+        return None
+    excerpt = "\n\n".join(chunk.text for chunk in chunks)[:SUMMARY_INPUT_CHARS]
+    payload = {
+        "model": CHAT_MODEL,
+        "messages": [
+            {
+                "role": "user",
+                "content": (
+                    f"Summarize what the document '{chunks[0].title}' covers in two or "
+                    f"three sentences, naming its main topics.\n\n{excerpt}"
+                ),
+            },
+        ],
+        "temperature": 0.1,
+        "max_tokens": 128,
+    }
+    try:
+        summary = await _post_chat(payload, priority=Priority.BULK)
+        [embedding] = await get_embeddings([summary])
+    except Exception:
+        logger.exception("Could not summarize document %s", doc_id)
+        return None
+    if not set_document_summary(doc_id, summary, embedding, collection):
+        return None  # deleted meanwhile
+    return summary
+
+
+async def _ensure_wikipedia_context(
+    question: str,
+    max_new_articles: int = AUTO_WIKI_ARTICLES,
+    collection: Optional[str] = None,
+):
     """
     Fetch and embed Wikipedia content relevant to the question if we do not already
-    have enough Wikipedia context stored locally.
+    have enough Wikipedia context stored locally in the collection.
     """
     if max_new_articles <= 0:
         return
 
-    existing_titles = {doc.title for doc in get_docs(source="wikipedia")}
+    existing_titles = {doc.title for doc in get_docs(source="wikipedia", collection=collection)}
     try:
         candidate_titles = wikipedia.search(question, results=max_new_articles * 3)
     except wikipedia.exceptions.WikipediaException:
@@ -207,38 +493,32 @@ async def _ensure_wikipedia_context(question: str, max_new_articles: int = AUTO_
             page = wikipedia.page(title, auto_suggest=True)
         except (wikipedia.exceptions.DisambiguationError, wikipedia.exceptions.PageError):
             continue
-        await store_text(title=page.title, text=page.content, source="wikipedia", max_chunks=5)
+        await store_text(
+            title=page.title,
+            text=page.content,
+            source="wikipedia",
+            max_chunks=5,
+            collection=collection,
+            # A user is waiting on this question, so don't queue behind bulk ingest.
+            priority=Priority.QUERY,
+        )
         existing_titles.add(page.title)
         added += 1
         if added >= max_new_articles:
             break
 
 
-async def rag_answer(question: str, top_k: int = 3, sources: Optional[List[str]] = None):
-    # Only auto-fetch Wikipedia if explicitly enabled via AUTO_WIKI_ARTICLES > 0
-    include_wikipedia = (AUTO_WIKI_ARTICLES > 0) and (sources is None or "wikipedia" in sources)
-    if include_wikipedia:
-        await _ensure_wikipedia_context(question)
-
-    q_embedding = await get_embedding(question)
-
-    docs = get_docs()
-    if sources:
-        docs = [d for d in docs if d.source in sources]
-
-    scored = []
-    for d in docs:
-        score = cosine_similarity(q_embedding, d.embedding)
-        scored.append((score, d))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top_scored = scored[:top_k]
+def _build_prompt(chunks: List[DocChunk], question: str) -> str:
+    if not chunks:
+        return f"""
+Question:
 
+{question}
+"""
     context_text = "\n\n".join(
-        f"[{d.source.upper()} - {d.title}] {d.text}" for (_, d) in top_scored
+        f"[{d.source.upper()} - {d.title}] {d.text}" for d in chunks
     )
-
-    prompt = f"""
+    return f"""
 Context:
 
 {context_text}
@@ -248,7 +528,127 @@ Question:
 {question}
 """
 
+
+# How often each retrieval path was taken: "full" (every retrieved chunk used),
+# "trimmed" (some cut by score) and "no_context" (answered without the LLM).
+retrieval_paths: Counter = Counter()
+
+
+def select_context(
+    top_scored: List[Tuple[float, DocChunk]],
+    min_score: Optional[float] = None,
+    max_score_gap: Optional[float] = None,
+) -> List[Tuple[float, DocChunk]]:
+    """
+    Trim best-first search results: drop chunks below min_score and, if
+    max_score_gap > 0, those scoring more than max_score_gap below the best one.
+    None uses RETRIEVAL_MIN_SCORE / RETRIEVAL_SCORE_GAP.
+    """
+    min_score = RETRIEVAL_MIN_SCORE if min_score is None else min_score
+    max_score_gap = RETRIEVAL_SCORE_GAP if max_score_gap is None else max_score_gap
+    if not top_scored:
+        return []
+    floor = min_score
+    if max_score_gap > 0:
+        floor = max(floor, top_scored[0][0] - max_score_gap)
+    return [(score, chunk) for score, chunk in top_scored if score >= floor]
+
+
+def _count_path(retrieved: int, kept: int, answered: bool) -> None:
+    if not answered:
+        retrieval_paths["no_context"] += 1
+    elif kept < retrieved:
+        retrieval_paths["trimmed"] += 1
+    else:
+        retrieval_paths["full"] += 1
+
+
+async def rag_answer(
+    question: str,
+    top_k: int = 3,
+    sources: Optional[List[str]] = None,
+    collection: Optional[str] = None,
+    session: Optional[Session] = None,
+    min_score: Optional[float] = None,
+    max_score_gap: Optional[float] = None,
+    answer_without_context: bool = False,
+):
+    """
+    Answer a question from the top_k most similar chunks, trimmed by select_context.
+    If no chunk is left (and a session holds no earlier context), NO_CONTEXT_ANSWER
+    is returned without calling the LLM unless answer_without_context is set.
+    Returns (answer, the (score, chunk) pairs used).
+    """
+    # Only auto-fetch Wikipedia if explicitly enabled via AUTO_WIKI_ARTICLES > 0
+    include_wikipedia = (AUTO_WIKI_ARTICLES > 0) and (sources is None or "wikipedia" in sources)
+    if include_wikipedia:
+        await _ensure_wikipedia_context(question, collection=collection)
+
+    if session is not None:
+        async with session.lock:
+            return await _session_answer(
+                session, question, top_k, sources, collection,
+                min_score, max_score_gap, answer_without_context,
+            )
+
+    q_embedding = await get_embedding(question)
+
+    retrieved: List[Tuple[float, DocChunk]] = search(q_embedding, top_k, sources, collection)
+    top_scored = select_context(retrieved, min_score, max_score_gap)
+    if not top_scored and not answer_without_context:
+        _count_path(len(retrieved), 0, answered=False)
+        return NO_CONTEXT_ANSWER, []
+    _count_path(len(retrieved), len(top_scored), answered=True)
+
+    prompt = _build_prompt([d for _, d in top_scored], question)
+
     answer = await call_mistral_chat(prompt)
 
     return answer, top_scored
 
+
+async def _session_answer(
+    session: Session,
+    question: str,
+    top_k: int,
+    sources: Optional[List[str]],
+    collection: Optional[str],
+    min_score: Optional[float] = None,
+    max_score_gap: Optional[float] = None,
+    answer_without_context: bool = False,
+):
+    """
+    Follow-up turn: only chunks the session has not seen yet are added to the
+    prompt, and earlier turns are replayed verbatim so the request shares a
+    stable prefix with the previous one.
+
+    The session is only updated once the chat call succeeds, so a failed turn
+    leaves nothing behind that the next prompt would assume was already sent.
+    """
+    q_embedding = session.query_embeddings.get(question)
+    if q_embedding is None:
+        q_embedding = await get_embedding(question)
+
+    retrieved: List[Tuple[float, DocChunk]] = search(q_embedding, top_k, sources, collection)
+    top_scored = select_context(retrieved, min_score, max_score_gap)
+
+    # Deleted or replaced chunks must not be replayed; their text is also in the
+    # history, so drop that too and start over from the chunks still live.
+    if session.retain(live_chunk_ids(session.chunks, collection)) or session.needs_rebase():
+        session.rebase()
+    if not top_scored and not session.chunks and not answer_without_context:
+        _count_path(len(retrieved), 0, answered=False)
+        return NO_CONTEXT_ANSWER, []
+    _count_path(len(retrieved), len(top_scored), answered=True)
+    # After a rebase (or on the first turn) the held chunks must be sent again.
+    resend = [] if session.messages else list(session.chunks)
+    new_chunks = session.unseen([d for _, d in top_scored])
+
+    prompt = _build_prompt(resend + new_chunks, question)
+    answer = await call_mistral_chat(prompt, history=list(session.messages))
+
+    session.query_embeddings[question] = q_embedding
+    session.add_chunks(new_chunks)
+    session.record_turn(prompt, answer)
+
+    return answer, top_scored
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from fastapi import HTTPException  # type: ignore[import-not-found]
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Sized to the Mistral quota: sustained requests per second and burst allowance.
+UPSTREAM_RPS = float(os.getenv("UPSTREAM_RPS", "1"))
+UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", "2"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "4"))
+# Bulk ingest may never hold more than this many concurrent slots, so live chats
+# always find one free.
+UPSTREAM_BULK_CONCURRENCY = int(os.getenv("UPSTREAM_BULK_CONCURRENCY", "2"))
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # chat completions
+    QUERY = 1  # query embeddings
+    BULK = 2  # ingestion embeddings
+
+
+# Requests waiting per class before new ones are shed with a 503.
+DEFAULT_QUEUE_LIMITS = {
+    Priority.INTERACTIVE: int(os.getenv("UPSTREAM_QUEUE_INTERACTIVE", "64")),
+    Priority.QUERY: int(os.getenv("UPSTREAM_QUEUE_QUERY", "64")),
+    Priority.BULK: int(os.getenv("UPSTREAM_QUEUE_BULK", "256")),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _ClassMetrics:
+    def __init__(self) -> None:
+        self.granted = 0
+        self.shed = 0
+        self.waits: Deque[float] = deque(maxlen=1024)  # recent queue times, seconds
+
+    def snapshot(self, depth: int) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def pct(p: float) -> float:
+            return waits[min(len(waits) - 1, int(p * len(waits)))] * 1000 if waits else 0.0
+
+        return {
+            "queued": depth,
+            "granted": self.granted,
+            "shed": self.shed,
+            "wait_ms_p50": pct(0.50),
+            "wait_ms_p99": pct(0.99),
+            "wait_ms_max": waits[-1] * 1000 if waits else 0.0,
+        }
+
+
+class UpstreamScheduler:
+    """
+    Admission control for upstream API calls.
+
+    Callers queue by priority class; a slot is granted to the highest-priority
+    waiter whenever a rate token and a concurrency slot are both available.
+    Bulk work is capped below the total concurrency, and a class whose queue is
+    full sheds new requests immediately with a 503 instead of piling up.
+    """
+
+    def __init__(
+        self,
+        rate: float = UPSTREAM_RPS,
+        burst: int = UPSTREAM_BURST,
+        max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+        bulk_concurrency: int = UPSTREAM_BULK_CONCURRENCY,
+        queue_limits: Optional[Dict[Priority, int]] = None,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.bulk_concurrency = min(bulk_concurrency, max_concurrency)
+        self.queue_limits = dict(queue_limits or DEFAULT_QUEUE_LIMITS)
+        self._queues: Dict[Priority, Deque["asyncio.Future[None]"]] = {p: deque() for p in Priority}
+        self._metrics: Dict[Priority, _ClassMetrics] = {p: _ClassMetrics() for p in Priority}
+        self._active = 0
+        self._active_bulk = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Waiters, slots and the refill timer of a previous event loop (e.g. an
+        # earlier asyncio.run() in a worker) can never be resolved on this one.
+        if loop is self._loop:
+            return
+        self._loop = loop
+        self._queues = {p: deque() for p in Priority}
+        self._active = 0
+        self._active_bulk = 0
+        self._timer = None
+
+    async def run(self, priority: Priority, fn: Callable[[], Awaitable[T]]) -> T:
+        """Wait for admission in `priority`'s class, then await fn()."""
+        loop = asyncio.get_running_loop()
+        self._bind(loop)
+        queue = self._queues[priority]
+        metrics = self._metrics[priority]
+        if len(queue) >= self.queue_limits[priority]:
+            metrics.shed += 1
+            logger.warning("Shedding %s upstream request: queue full", priority.name.lower())
+            raise HTTPException(
+                status_code=503,
+                detail="The assistant is busy right now. Please try again in a moment.",
+            )
+
+        future: "asyncio.Future[None]" = loop.create_future()
+        queue.append(future)
+        enqueued = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future in queue:
+                queue.remove(future)
+            elif future.done() and not future.cancelled():
+                self._release(priority)
+            raise
+        metrics.granted += 1
+        metrics.waits.append(time.monotonic() - enqueued)
+
+        try:
+            return await fn()
+        finally:
+            self._release(priority)
+
+    def _release(self, priority: Priority) -> None:
+        self._active -= 1
+        if priority is Priority.BULK:
+            self._active_bulk -= 1
+        self._dispatch()
+
+    def _next_waiter(self) -> Optional[Priority]:
+        for priority in Priority:
+            queue = self._queues[priority]
+            while queue and queue[0].done():
+                queue.popleft()  # cancelled while waiting
+            if not queue:
+                continue
+            if priority is Priority.BULK and self._active_bulk >= self.bulk_concurrency:
+                continue
+            return priority
+        return None
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency:
+            priority = self._next_waiter()
+            if priority is None:
+                return
+            if not self.bucket.try_take():
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        self.bucket.time_until_token(), self._on_timer
+                    )
+                return
+            self._active += 1
+            if priority is Priority.BULK:
+                self._active_bulk += 1
+            self._queues[priority].popleft().set_result(None)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "tokens": round(self.bucket.tokens, 3),
+            "classes": {
+                p.name.lower(): self._metrics[p].snapshot(len(self._queues[p])) for p in Priority
+            },
+        }
+
+
+upstream = UpstreamScheduler()
+
+
+def share_quota(processes: int) -> None:
+    """
+    Limit this process to 1/`processes` of the upstream rate. Each process has its
+    own bucket, so worker pools sharing one API key must split the quota.
+    """
+    processes = max(processes, 1)
+    upstream.bucket = TokenBucket(UPSTREAM_RPS / processes, max(1, UPSTREAM_BURST // processes))
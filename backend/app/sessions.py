@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from .store import DocChunk
+
+
+# Bounds on server-side conversation state.
+MAX_SESSIONS = int(os.getenv("STUDYBUDDY_MAX_SESSIONS", "500"))
+SESSION_IDLE_SECONDS = float(os.getenv("STUDYBUDDY_SESSION_IDLE_SECONDS", "1800"))
+# Chunks and question/answer turns kept per session before the history is re-based.
+MAX_SESSION_CHUNKS = int(os.getenv("STUDYBUDDY_SESSION_CHUNKS", "12"))
+MAX_SESSION_TURNS = int(os.getenv("STUDYBUDDY_SESSION_TURNS", "10"))
+
+
+@dataclass
+class Session:
+    """
+    Conversation state for follow-up questions.
+
+    `messages` is the exact user/assistant history already sent to the LLM. New
+    turns are only ever appended to it, so every request starts with the previous
+    request's messages verbatim and provider-side prompt caching can reuse them.
+    """
+
+    id: UUID
+    collection: Optional[str]
+    sources: Optional[Tuple[str, ...]]
+    chunks: List[DocChunk] = field(default_factory=list)  # first-seen order
+    chunk_ids: Set[UUID] = field(default_factory=set)
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    query_embeddings: Dict[str, List[float]] = field(default_factory=dict)
+    last_used: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def turns(self) -> int:
+        return len(self.messages) // 2
+
+    def unseen(self, candidates: List[DocChunk]) -> List[DocChunk]:
+        """The retrieved chunks not already in the session."""
+        return [chunk for chunk in candidates if chunk.id not in self.chunk_ids]
+
+    def add_chunks(self, chunks: List[DocChunk]) -> None:
+        self.chunks.extend(chunks)
+        self.chunk_ids.update(chunk.id for chunk in chunks)
+
+    def retain(self, live_ids: Set[UUID]) -> bool:
+        """Forget chunks that were deleted or replaced; returns True if any were."""
+        kept = [chunk for chunk in self.chunks if chunk.id in live_ids]
+        if len(kept) == len(self.chunks):
+            return False
+        self.chunks = kept
+        self.chunk_ids = {chunk.id for chunk in kept}
+        return True
+
+    def record_turn(self, prompt: str, answer: str) -> None:
+        self.messages.append({"role": "user", "content": prompt})
+        self.messages.append({"role": "assistant", "content": answer})
+
+    def needs_rebase(self) -> bool:
+        return self.turns >= MAX_SESSION_TURNS or len(self.chunks) > MAX_SESSION_CHUNKS
+
+    def rebase(self) -> None:
+        """
+        Drop the turn history and keep only the most recent chunks. The next
+        prompt re-sends them as context, starting a new cacheable prefix.
+        """
+        self.chunks = self.chunks[-MAX_SESSION_CHUNKS:]
+        self.chunk_ids = {chunk.id for chunk in self.chunks}
+        self.messages = []
+        self.query_embeddings.clear()
+
+
+# Session id -> session, least recently used first.
+_sessions: "OrderedDict[UUID, Session]" = OrderedDict()
+
+
+def _expire(now: float) -> None:
+    while _sessions:
+        oldest = next(iter(_sessions.values()))
+        if now - oldest.last_used < SESSION_IDLE_SECONDS:
+            break
+        _sessions.popitem(last=False)
+
+
+def get_session(
+    session_id: UUID,
+    collection: Optional[str] = None,
+    sources: Optional[List[str]] = None,
+) -> Session:
+    """
+    Return the live session for `session_id`, creating it if unknown or expired.
+    A session is reset when the collection or source filter changes, since its
+    retrieved chunks would no longer match.
+    """
+    now = time.monotonic()
+    _expire(now)
+    key_sources = tuple(sorted(sources)) if sources else None
+    session = _sessions.get(session_id)
+    if session is None or session.collection != collection or session.sources != key_sources:
+        session = Session(id=session_id, collection=collection, sources=key_sources)
+        _sessions[session_id] = session
+    session.last_used = now
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > MAX_SESSIONS:
+        _sessions.popitem(last=False)
+    return session
+
+
+def end_session(session_id: UUID) -> bool:
+    return _sessions.pop(session_id, None) is not None
+
+
+def session_count() -> int:
+    _expire(time.monotonic())
+    return len(_sessions)
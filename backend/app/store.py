@@ -1,11 +1,23 @@
+import asyncio
+import hashlib
+import heapq
 import json
+import logging
 import os
-from dataclasses import dataclass
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from pathlib import Path
 from threading import Lock
-from typing import Any, Dict, List, Optional
-from uuid import UUID, uuid4
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from uuid import NAMESPACE_URL, UUID, uuid4, uuid5
 
+import numpy as np  # type: ignore[import-not-found]
+
+from .index import DocumentCentroids, EmbeddingIndex, fit_projection
+
+logger = logging.getLogger(__name__)
 
 DATA_PATH = Path(
     os.getenv(
@@ -13,7 +25,49 @@ DATA_PATH = Path(
         Path(__file__).resolve().parent / "data" / "store.json",
     )
 )
+# Named collections live next to the main store, one JSON file each, plus a
+# manifest of their sizes so stats never have to load them.
+COLLECTIONS_DIR = DATA_PATH.parent / "collections"
+COLLECTIONS_MANIFEST = DATA_PATH.parent / "collections.json"
+# Question/feedback counters and rollups, kept out of the (large) corpus file: a
+# periodic snapshot plus append-only logs of question events and feedback entries
+# written since, so recording an event never rewrites the snapshot.
+ANALYTICS_PATH = DATA_PATH.parent / "analytics.json"
+ANALYTICS_LOG = DATA_PATH.parent / "analytics.jsonl"
+FEEDBACK_LOG = DATA_PATH.parent / "feedback.jsonl"
+ANALYTICS_SNAPSHOT_EVERY = int(os.getenv("STUDYBUDDY_ANALYTICS_SNAPSHOT_EVERY", "1000"))
 _STATE_LOCK = Lock()
+# Compact once this fraction of index rows are tombstones.
+COMPACT_RATIO = float(os.getenv("STUDYBUDDY_COMPACT_RATIO", "0.25"))
+# Max chunks kept resident across named collections before LRU eviction.
+COLLECTION_MEMORY_BUDGET = int(os.getenv("STUDYBUDDY_COLLECTION_BUDGET", "100000"))
+
+# Width of the analytics time buckets and how many of the latest ones are kept.
+ROLLUP_BUCKET_SECONDS = int(os.getenv("STUDYBUDDY_ROLLUP_BUCKET_SECONDS", "3600"))
+ROLLUP_BUCKETS = int(os.getenv("STUDYBUDDY_ROLLUP_BUCKETS", "168"))
+# Most-cited documents reported by get_analytics().
+TOP_CITED = 20
+
+# Optional reduced-dimension scoring: "pca", "random" or "off". A collection is
+# (re)fitted in the background once it has PROJECTION_MIN_ROWS live chunks and
+# whenever it has grown by PROJECTION_REFIT_GROWTH since the last fit.
+PROJECTION_METHOD = os.getenv("STUDYBUDDY_PROJECTION", "off")
+PROJECTION_DIM = int(os.getenv("STUDYBUDDY_PROJECTION_DIM", "256"))
+PROJECTION_MIN_ROWS = int(os.getenv("STUDYBUDDY_PROJECTION_MIN_ROWS", "5000"))
+PROJECTION_REFIT_GROWTH = float(os.getenv("STUDYBUDDY_PROJECTION_REFIT_GROWTH", "0.5"))
+PROJECTION_SAMPLE_ROWS = 20000
+# Candidates re-scored at full dimension per requested result.
+RERANK_FACTOR = int(os.getenv("STUDYBUDDY_RERANK_FACTOR", "8"))
+
+# Coarse-to-fine search: in collections with at least COARSE_MIN_DOCS documents,
+# only the chunks of the COARSE_DOCS documents nearest the query are scored
+# (0 disables it).
+COARSE_DOCS = int(os.getenv("STUDYBUDDY_COARSE_DOCS", "32"))
+COARSE_MIN_DOCS = int(os.getenv("STUDYBUDDY_COARSE_MIN_DOCS", "1000"))
+
+DEFAULT_COLLECTION = "default"
+COLLECTION_NAME_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
+_COLLECTION_NAME_RE = re.compile(COLLECTION_NAME_PATTERN)
 
 
 @dataclass
@@ -24,12 +78,194 @@ class DocChunk:
     source: str  # "user" | "wikipedia"
     title: str
     url: Optional[str] = None
+    doc_id: Optional[UUID] = None
+    content_hash: str = ""
+
+
+class Collection:
+    """
+    One workspace: its chunks, a unit-vector matrix aligned row-for-row with them
+    and a doc_id -> rows map. Deleted rows are tombstoned in the index's alive
+    mask until compact() reclaims them. Per-document centroids (and optional
+    summaries) are kept in step for coarse-to-fine search.
+    """
+
+    def __init__(self, name: str, chunks: Optional[List[DocChunk]] = None):
+        self.name = name
+        self.chunks: List[DocChunk] = []
+        self.index = EmbeddingIndex()
+        # doc_id -> row numbers in chunks (including tombstoned rows)
+        self.doc_rows: Dict[UUID, List[int]] = {}
+        # Live counts kept in step with every change, so summary() never scans rows.
+        self.live_chunks = 0
+        self.live_documents = 0
+        self.doc_live_chunks: Dict[UUID, int] = {}
+        self.centroids = DocumentCentroids()
+        # doc_id -> {"text", "embedding"} of a generated document summary
+        self.doc_summaries: Dict[UUID, Dict[str, Any]] = {}
+        # Stored chunks whose embedding dimension does not match the index (e.g.
+        # after an embedding model change): persisted, but not searchable.
+        self.unindexed: List[DocChunk] = []
+        if chunks:
+            try:
+                self.append(chunks)
+            except ValueError:
+                # Mixed dimensions: index the majority dimension, keep the rest aside.
+                dims = [len(c.embedding) for c in chunks if c.embedding]
+                dim = max(set(dims), key=dims.count)
+                self.append([c for c in chunks if len(c.embedding) in (0, dim)])
+                self.unindexed = [c for c in chunks if len(c.embedding) not in (0, dim)]
+                logger.warning(
+                    "Collection %r: %d chunk(s) have an embedding dimension other than %d; "
+                    "they are kept but not searchable until re-embedded",
+                    name,
+                    len(self.unindexed),
+                    dim,
+                )
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def live_rows(self) -> List[int]:
+        return np.flatnonzero(self.index.alive).tolist()
+
+    def _count_live(self, doc_ids: Iterable[UUID], sign: int = 1) -> None:
+        for doc_id in doc_ids:
+            before = self.doc_live_chunks.get(doc_id, 0)
+            after = before + sign
+            if after:
+                self.doc_live_chunks[doc_id] = after
+            else:
+                del self.doc_live_chunks[doc_id]
+            self.live_documents += bool(after) - bool(before)
+            self.live_chunks += sign
+
+    def _index_rows(self, start: int = 0) -> None:
+        if start == 0:
+            self.doc_rows.clear()
+        for row in range(start, len(self.chunks)):
+            self.doc_rows.setdefault(self.chunks[row].doc_id, []).append(row)
+
+    def append(self, chunks: List[DocChunk]) -> None:
+        embeddings = [chunk.embedding for chunk in chunks]
+        self.index.check(embeddings)
+        size = len(self.chunks)
+        self.chunks.extend(chunks)
+        self.index.add(embeddings, [chunk.source for chunk in chunks])
+        self._index_rows(size)
+        self._count_live(c.doc_id for c in chunks)
+        if chunks:
+            self.centroids.update([c.doc_id for c in chunks], self.index.matrix[size:])
+            for chunk in chunks:
+                self.centroids.set_label(chunk.doc_id, chunk.source)
+
+    def delete_rows(self, rows: List[int]) -> None:
+        rows = [row for row in rows if self.index.alive[row]]
+        if rows:
+            self.centroids.update([self.chunks[r].doc_id for r in rows], self.index.matrix[rows], -1)
+        self._count_live((self.chunks[r].doc_id for r in rows), -1)
+        self.index.delete(rows)
+
+    def restore_rows(self, rows: List[int]) -> None:
+        rows = [row for row in rows if not self.index.alive[row]]
+        if rows:
+            self.centroids.update([self.chunks[r].doc_id for r in rows], self.index.matrix[rows])
+        self._count_live(self.chunks[r].doc_id for r in rows)
+        self.index.restore(rows)
+
+    def set_summary(self, doc_id: UUID, summary: Optional[Dict[str, Any]]) -> None:
+        if summary is None:
+            self.doc_summaries.pop(doc_id, None)
+            if doc_id in self.doc_rows:
+                self.centroids.set_summary(doc_id, None)
+            return
+        self.doc_summaries[doc_id] = summary
+        self.centroids.set_summary(doc_id, summary["embedding"])
+
+    def rollback_append(self, size: int) -> None:
+        self.delete_rows(list(range(size, len(self.chunks))))
+        for row in range(size, len(self.chunks)):
+            rows = self.doc_rows[self.chunks[row].doc_id]
+            rows.remove(row)
+            if not rows:
+                del self.doc_rows[self.chunks[row].doc_id]
+        del self.chunks[size:]
+        self.index.truncate(size)
+
+    def drop_unindexed(self, doc_id: UUID) -> List[DocChunk]:
+        """Remove and return a document's unindexed chunks."""
+        dropped = [c for c in self.unindexed if c.doc_id == doc_id]
+        if dropped:
+            self.unindexed = [c for c in self.unindexed if c.doc_id != doc_id]
+        return dropped
+
+    def stored_chunks(self) -> List[DocChunk]:
+        """Everything that is written to disk: live chunks, then unindexed ones."""
+        return [self.chunks[row] for row in self.live_rows()] + self.unindexed
+
+    def document_rows(self, doc_id: UUID) -> List[int]:
+        alive = self.index.alive
+        return [row for row in self.doc_rows.get(doc_id, []) if alive[row]]
+
+    def compact(self) -> int:
+        reclaimed = self.index.dead
+        if not reclaimed:
+            return 0
+        kept = self.index.compact()
+        self.chunks[:] = [self.chunks[row] for row in kept]
+        self._index_rows()
+        self._rebuild_centroids()
+        return reclaimed
+
+    def _rebuild_centroids(self) -> None:
+        # Drops deleted documents and any drift from incremental updates.
+        self.centroids = DocumentCentroids()
+        if self.chunks:
+            self.centroids.update([c.doc_id for c in self.chunks], self.index.matrix)
+            for chunk in self.chunks:
+                self.centroids.set_label(chunk.doc_id, chunk.source)
+        for doc_id in list(self.doc_summaries):
+            if doc_id in self.doc_rows:
+                self.set_summary(doc_id, self.doc_summaries[doc_id])
+            else:
+                del self.doc_summaries[doc_id]
+
+    def summary(self) -> Dict[str, int]:
+        return {"documents": self.live_documents, "chunks": self.live_chunks}
 
 
 # In-memory storage
-_doc_chunks: List[DocChunk] = []
+_default = Collection(DEFAULT_COLLECTION)
+# Named collections currently resident, least recently used first.
+_collections: "OrderedDict[str, Collection]" = OrderedDict()
+# name -> {"documents", "chunks"} for every named collection, loaded or not.
+_collection_summaries: Dict[str, Dict[str, int]] = {}
 _questions_count: int = 0
-_feedback_list: List[Dict[str, Any]] = []
+_collection_questions: Dict[str, int] = {}
+_feedback_counts: Dict[str, int] = {"total": 0, "positive": 0, "negative": 0}
+# bucket start (epoch seconds) -> counts, oldest first, at most ROLLUP_BUCKETS.
+_rollups: "OrderedDict[int, Dict[str, int]]" = OrderedDict()
+# doc_id -> {"doc_id", "title", "collection", "citations"}: times retrieved for a question.
+_citations: Dict[str, Dict[str, Any]] = {}
+# Keys of _citations with the highest counts, most cited first.
+_top_cited: List[str] = []
+# Sequence number of the last analytics.jsonl event, feedback.jsonl entries counted
+# so far, and events of either kind not yet folded into analytics.json.
+_analytics_seq = 0
+_feedback_logged = 0
+_unsnapshotted = 0
+# Collections changed with flush=False and not yet written.
+_dirty: Set[str] = set()
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def validate_collection_name(name: str) -> str:
+    if not _COLLECTION_NAME_RE.match(name):
+        raise ValueError(f"Invalid collection name {name!r}")
+    return name
 
 
 def _ensure_data_dir() -> None:
@@ -44,49 +280,274 @@ def _serialize_chunk(chunk: DocChunk) -> Dict[str, Any]:
         "source": chunk.source,
         "title": chunk.title,
         "url": chunk.url,
+        "doc_id": str(chunk.doc_id),
+        "content_hash": chunk.content_hash,
     }
 
 
+def _deserialize_chunks(raw_chunks: List[Dict[str, Any]]) -> List[DocChunk]:
+    doc_chunks = []
+    for raw in raw_chunks:
+        try:
+            text = raw.get("text", "")
+            source = raw.get("source", "user")
+            title = raw.get("title", "")
+            # Chunks stored before documents had ids are grouped by source + title.
+            doc_id = raw.get("doc_id")
+            chunk = DocChunk(
+                id=UUID(raw["id"]),
+                text=text,
+                embedding=raw.get("embedding", []),
+                source=source,
+                title=title,
+                url=raw.get("url"),
+                doc_id=UUID(doc_id) if doc_id else uuid5(NAMESPACE_URL, f"{source}:{title}"),
+                content_hash=raw.get("content_hash") or content_hash(text),
+            )
+            doc_chunks.append(chunk)
+        except (KeyError, ValueError):
+            continue
+    return doc_chunks
+
+
+def _serialize_summaries(collection: Collection) -> List[Dict[str, Any]]:
+    return [
+        {"doc_id": str(doc_id), **summary} for doc_id, summary in collection.doc_summaries.items()
+    ]
+
+
+def _load_summaries(collection: Collection, raw: List[Dict[str, Any]]) -> None:
+    for entry in raw:
+        try:
+            doc_id = UUID(entry["doc_id"])
+            summary = {"text": entry["text"], "embedding": entry["embedding"]}
+        except (KeyError, ValueError):
+            continue
+        if doc_id in collection.doc_rows:
+            collection.set_summary(doc_id, summary)
+
+
+def _collection_path(name: str) -> Path:
+    return COLLECTIONS_DIR / f"{name}.json"
+
+
 def _save_state() -> None:
+    # Tombstoned chunks are never written, so the file is always compact.
+    _dirty.discard(DEFAULT_COLLECTION)
     payload = {
-        "doc_chunks": [_serialize_chunk(chunk) for chunk in _doc_chunks],
-        "questions_count": _questions_count,
-        "feedback": _feedback_list,
+        "doc_chunks": [_serialize_chunk(chunk) for chunk in _default.stored_chunks()],
+        "doc_summaries": _serialize_summaries(_default),
     }
     with _STATE_LOCK:
         _ensure_data_dir()
-        with DATA_PATH.open("w", encoding="utf-8") as fp:
+        # An interrupted write (e.g. a long dump ingest stopped mid-flush) must
+        # leave the previous file intact.
+        tmp = DATA_PATH.with_suffix(".json.tmp")
+        with tmp.open("w", encoding="utf-8") as fp:
             json.dump(payload, fp, ensure_ascii=False, indent=2)
+        tmp.replace(DATA_PATH)
 
 
-def _load_state() -> None:
-    global _doc_chunks, _questions_count, _feedback_list
-    if not DATA_PATH.exists():
+def _save_collection(collection: Collection) -> None:
+    _collection_summaries[collection.name] = collection.summary()
+    payload = {
+        "doc_chunks": [_serialize_chunk(chunk) for chunk in collection.stored_chunks()],
+        "doc_summaries": _serialize_summaries(collection),
+    }
+    with _STATE_LOCK:
+        COLLECTIONS_DIR.mkdir(parents=True, exist_ok=True)
+        path = _collection_path(collection.name)
+        tmp = path.with_suffix(".json.tmp")
+        with tmp.open("w", encoding="utf-8") as fp:
+            json.dump(payload, fp, ensure_ascii=False)
+        tmp.replace(path)
+        with COLLECTIONS_MANIFEST.open("w", encoding="utf-8") as fp:
+            json.dump(_collection_summaries, fp)
+
+
+def _persist(collection: Collection) -> None:
+    _dirty.discard(collection.name)
+    if collection is _default:
+        _save_state()
+    else:
+        _save_collection(collection)
+
+
+def _save_analytics() -> None:
+    """Write a snapshot of every counter and start a new analytics.jsonl."""
+    global _unsnapshotted
+    payload = {
+        "questions_count": _questions_count,
+        "collection_questions": _collection_questions,
+        "feedback_counts": _feedback_counts,
+        "rollups": [[start, counts] for start, counts in _rollups.items()],
+        "citations": list(_citations.values()),
+        "seq": _analytics_seq,
+        "feedback_logged": _feedback_logged,
+    }
+    with _STATE_LOCK:
+        _ensure_data_dir()
+        tmp = ANALYTICS_PATH.with_suffix(".json.tmp")
+        with tmp.open("w", encoding="utf-8") as fp:
+            json.dump(payload, fp, ensure_ascii=False)
+        tmp.replace(ANALYTICS_PATH)
+        # Events up to "seq" are in the snapshot and skipped on replay, so a crash
+        # before this truncation cannot count them twice.
+        ANALYTICS_LOG.open("w").close()
+    _unsnapshotted = 0
+
+
+def _append_lines(path: Path, entries: List[Dict[str, Any]]) -> None:
+    with _STATE_LOCK:
+        _ensure_data_dir()
+        with path.open("a", encoding="utf-8") as fp:
+            for entry in entries:
+                fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def _append_feedback_log(entries: List[Dict[str, Any]]) -> None:
+    global _feedback_logged
+    _append_lines(FEEDBACK_LOG, entries)
+    _feedback_logged += len(entries)
+
+
+def _log_analytics_event(event: Dict[str, Any]) -> None:
+    global _analytics_seq
+    _analytics_seq += 1
+    _append_lines(ANALYTICS_LOG, [{"seq": _analytics_seq, **event}])
+
+
+def _event_recorded() -> None:
+    global _unsnapshotted
+    _unsnapshotted += 1
+    if _unsnapshotted >= ANALYTICS_SNAPSHOT_EVERY:
+        _save_analytics()
+
+
+def _read_lines(path: Path) -> Iterator[Dict[str, Any]]:
+    if not path.exists():
         return
-    try:
-        with DATA_PATH.open("r", encoding="utf-8") as fp:
-            data = json.load(fp)
-    except (json.JSONDecodeError, OSError):
+    with path.open("r", encoding="utf-8") as fp:
+        for line in fp:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash mid-append.
+                continue
+
+
+def _load_analytics(legacy: Dict[str, Any]) -> None:
+    global _questions_count, _collection_questions, _rollups, _citations
+    global _analytics_seq, _feedback_logged, _unsnapshotted
+    snapshot_feedback = 0
+    if ANALYTICS_PATH.exists():
+        try:
+            data = json.loads(ANALYTICS_PATH.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, OSError):
+            data = {}
+        _questions_count = data.get("questions_count", 0)
+        _collection_questions = data.get("collection_questions", {})
+        _feedback_counts.update(data.get("feedback_counts", {}))
+        _rollups = OrderedDict((int(start), counts) for start, counts in data.get("rollups", []))
+        _citations = {entry["doc_id"]: entry for entry in data.get("citations", [])}
+        _rebuild_top_cited()
+        _analytics_seq = data.get("seq", 0)
+        snapshot_feedback = data.get("feedback_logged", 0)
+    elif any(key in legacy for key in ("questions_count", "collection_questions", "feedback")):
+        # Stores written before analytics had their own file keep counters and every
+        # feedback entry inside store.json; move them out once.
+        feedback = legacy.get("feedback", [])
+        _questions_count = legacy.get("questions_count", 0)
+        _collection_questions = legacy.get("collection_questions", {})
+        _feedback_counts.update(
+            total=len(feedback),
+            positive=sum(1 for fb in feedback if fb.get("rating") == 1),
+            negative=sum(1 for fb in feedback if fb.get("rating") == -1),
+        )
+        if feedback:
+            _append_feedback_log(feedback)
+        _save_analytics()
         return
 
-    doc_chunks = []
-    for raw in data.get("doc_chunks", []):
+    # Replay whatever was logged after the snapshot.
+    snapshot_seq = _analytics_seq
+    for event in _read_lines(ANALYTICS_LOG):
+        if event.get("seq", 0) > snapshot_seq:
+            _apply_analytics_event(event)
+            _analytics_seq = event["seq"]
+            _unsnapshotted += 1
+    for count, entry in enumerate(_read_lines(FEEDBACK_LOG), 1):
+        if count > snapshot_feedback:
+            _apply_feedback(entry)
+            _unsnapshotted += 1
+        _feedback_logged = count
+
+
+def _load_state() -> None:
+    global _default, _collection_summaries
+    if COLLECTIONS_MANIFEST.exists():
         try:
-            chunk = DocChunk(
-                id=UUID(raw["id"]),
-                text=raw.get("text", ""),
-                embedding=raw.get("embedding", []),
-                source=raw.get("source", "user"),
-                title=raw.get("title", ""),
-                url=raw.get("url"),
-            )
-            doc_chunks.append(chunk)
-        except (KeyError, ValueError):
-            continue
+            _collection_summaries = json.loads(COLLECTIONS_MANIFEST.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, OSError):
+            _collection_summaries = {}
+
+    data: Dict[str, Any] = {}
+    if DATA_PATH.exists():
+        try:
+            with DATA_PATH.open("r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (json.JSONDecodeError, OSError):
+            pass
+
+    _default = Collection(DEFAULT_COLLECTION, _deserialize_chunks(data.get("doc_chunks", [])))
+    _load_summaries(_default, data.get("doc_summaries", []))
+    _load_analytics(data)
+
+
+def _load_collection(name: str) -> Collection:
+    path = _collection_path(name)
+    data: Dict[str, Any] = {}
+    if path.exists():
+        try:
+            with path.open("r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (json.JSONDecodeError, OSError):
+            pass
+    collection = Collection(name, _deserialize_chunks(data.get("doc_chunks", [])))
+    _load_summaries(collection, data.get("doc_summaries", []))
+    return collection
+
+
+def _evict() -> None:
+    """Drop least recently used collections until resident chunks fit the budget."""
+    resident = sum(len(c) for c in _collections.values())
+    while resident > COLLECTION_MEMORY_BUDGET and len(_collections) > 1:
+        _, evicted = _collections.popitem(last=False)
+        if evicted.name in _dirty:
+            _persist(evicted)
+        resident -= len(evicted)
 
-    _doc_chunks = doc_chunks
-    _questions_count = data.get("questions_count", 0)
-    _feedback_list = data.get("feedback", [])
+
+def _collection(name: Optional[str] = None) -> Collection:
+    """Return a collection, loading it from disk (and evicting others) on demand."""
+    if name is None or name == DEFAULT_COLLECTION:
+        return _default
+    collection = _collections.get(name)
+    if collection is None:
+        collection = _load_collection(validate_collection_name(name))
+        _collections[name] = collection
+    _collections.move_to_end(name)
+    _evict()
+    return collection
+
+
+def _existing_collection(name: Optional[str] = None) -> Optional[Collection]:
+    """Like _collection(), but returns None instead of creating an unknown collection."""
+    if name is None or name == DEFAULT_COLLECTION or name in _collections:
+        return _collection(name)
+    if name in _collection_summaries or _collection_path(validate_collection_name(name)).exists():
+        return _collection(name)
+    return None
 
 
 def add_doc_chunk(
@@ -96,36 +557,399 @@ def add_doc_chunk(
     title: str,
     url: Optional[str] = None,
     chunk_id: Optional[UUID] = None,
+    collection: Optional[str] = None,
 ) -> DocChunk:
     """Add a new document chunk to the store."""
-    if chunk_id is None:
-        chunk_id = uuid4()
-
-    chunk = DocChunk(
-        id=chunk_id,
-        text=text,
-        embedding=embedding,
-        source=source,
-        title=title,
-        url=url,
+    return add_doc_chunks(
+        [
+            {
+                "text": text,
+                "embedding": embedding,
+                "source": source,
+                "title": title,
+                "url": url,
+                "id": chunk_id,
+            }
+        ],
+        collection=collection,
+    )[0]
+
+
+def add_doc_chunks(
+    batch: Iterable[Dict[str, Any]],
+    collection: Optional[str] = None,
+    flush: bool = True,
+) -> List[DocChunk]:
+    """
+    Add many chunks at once. Each item takes the keyword arguments of add_doc_chunk
+    ("text", "embedding", "source", "title", optional "url" and "id").
+    Items may also carry a "doc_id" grouping chunks into one document; a chunk
+    without one becomes its own document.
+    The batch is applied atomically: one index update and one persistence flush,
+    and nothing is kept if validation or the flush fails. With flush=False the
+    write is left to a later flush() call.
+    """
+    chunks = [_make_chunk(item) for item in batch]
+    if not chunks:
+        return []
+    target = _collection(collection)
+    target.append(chunks)
+    try:
+        _persist_or_defer(target, flush)
+    except Exception:
+        target.rollback_append(len(target) - len(chunks))
+        raise
+    _evict()
+    return chunks
+
+
+def _persist_or_defer(collection: Collection, flush: bool) -> None:
+    if flush:
+        _persist(collection)
+    else:
+        _dirty.add(collection.name)
+
+
+def flush(collection: Optional[str] = None) -> None:
+    """Write a collection changed with flush=False to disk."""
+    name = collection or DEFAULT_COLLECTION
+    if name in _dirty:
+        _persist(_collection(collection))
+
+
+def _make_chunk(item: Dict[str, Any]) -> DocChunk:
+    return DocChunk(
+        id=item.get("id") or uuid4(),
+        text=item["text"],
+        embedding=item["embedding"],
+        source=item["source"],
+        title=item["title"],
+        url=item.get("url"),
+        doc_id=item.get("doc_id") or uuid4(),
+        content_hash=item.get("content_hash") or content_hash(item["text"]),
     )
-    _doc_chunks.append(chunk)
-    _save_state()
-    return chunk
 
 
-def get_docs(source: Optional[str] = None) -> List[DocChunk]:
-    """Get document chunks, optionally filtered by source."""
+def get_document(doc_id: UUID, collection: Optional[str] = None) -> List[DocChunk]:
+    """Live chunks of a document, in insertion order (empty if unknown or deleted)."""
+    target = _existing_collection(collection)
+    if target is None:
+        return []
+    return [target.chunks[row] for row in target.document_rows(doc_id)]
+
+
+def live_chunk_ids(chunks: Iterable[DocChunk], collection: Optional[str] = None) -> Set[UUID]:
+    """Ids of the given chunks that have not been deleted or replaced since."""
+    target = _existing_collection(collection)
+    if target is None:
+        return set()
+    live: Set[UUID] = set()
+    for doc_id in {chunk.doc_id for chunk in chunks}:
+        live.update(target.chunks[row].id for row in target.document_rows(doc_id))
+    return live
+
+
+def list_documents(collection: Optional[str] = None) -> List[Dict[str, Any]]:
+    """One summary entry per live document."""
+    target = _existing_collection(collection)
+    if target is None:
+        return []
+    documents = []
+    for doc_id in target.doc_rows:
+        rows = target.document_rows(doc_id)
+        if not rows:
+            continue
+        first = target.chunks[rows[0]]
+        documents.append(
+            {
+                "doc_id": doc_id,
+                "title": first.title,
+                "source": first.source,
+                "url": first.url,
+                "chunks": len(rows),
+                "summary": target.doc_summaries.get(doc_id, {}).get("text"),
+            }
+        )
+    return documents
+
+
+def delete_document(doc_id: UUID, collection: Optional[str] = None) -> int:
+    """
+    Tombstone every chunk of a document. The rows stop matching immediately;
+    the memory is reclaimed later by compact(). Returns the number of chunks removed.
+    """
+    target = _existing_collection(collection)
+    if target is None:
+        return 0
+    rows = target.document_rows(doc_id)
+    unindexed = target.drop_unindexed(doc_id)
+    if not rows and not unindexed:
+        return 0
+    summary = target.doc_summaries.get(doc_id)
+    target.delete_rows(rows)
+    target.set_summary(doc_id, None)
+    try:
+        _persist(target)
+    except Exception:
+        target.restore_rows(rows)
+        target.unindexed.extend(unindexed)
+        target.set_summary(doc_id, summary)
+        raise
+    _forget_citations(doc_id, target.name)
+    return len(rows) + len(unindexed)
+
+
+def replace_document(
+    doc_id: UUID,
+    batch: Iterable[Dict[str, Any]],
+    collection: Optional[str] = None,
+    flush: bool = True,
+) -> List[DocChunk]:
+    """
+    Replace a document's chunks with `batch` (same item shape as add_doc_chunks).
+    Existing chunks whose content hash reappears keep their ids and embeddings.
+    Those that already lead the batch in their stored order stay in place; from the
+    first new or reordered chunk on, chunks are appended (kept ones re-appended
+    with their stored embedding) so the stored order always follows the batch.
+    Everything else is tombstoned. Applied atomically with one flush (or none with
+    flush=False, as in add_doc_chunks). Returns the document's chunks in batch order.
+    """
+    target = _collection(collection)
+    by_hash: Dict[str, List[int]] = {}
+    for row in target.document_rows(doc_id):
+        by_hash.setdefault(target.chunks[row].content_hash, []).append(row)
+
+    matches: List[Tuple[Optional[int], Dict[str, Any]]] = []
+    for item in batch:
+        item = {**item, "doc_id": doc_id}
+        item.setdefault("content_hash", content_hash(item["text"]))
+        rows = by_hash.get(item["content_hash"])
+        matches.append((rows.pop(0) if rows else None, item))
+
+    in_place = 0
+    while in_place < len(matches):
+        row = matches[in_place][0]
+        if row is None or (in_place and row < matches[in_place - 1][0]):
+            break
+        in_place += 1
+    kept = matches[:in_place]
+    new_chunks = [
+        _make_chunk(item)
+        if row is None
+        else replace(target.chunks[row], source=item["source"], title=item["title"], url=item.get("url"))
+        for row, item in matches[in_place:]
+    ]
+    dropped = [row for rows in by_hash.values() for row in rows]
+    dropped.extend(row for row, _ in matches[in_place:] if row is not None)
+
+    previous_meta = []
+    for row, item in kept:
+        chunk = target.chunks[row]
+        previous_meta.append((row, chunk.source, chunk.title, chunk.url))
+        chunk.source, chunk.title, chunk.url = item["source"], item["title"], item.get("url")
+        target.index.set_label([row], chunk.source)
+        target.centroids.set_label(doc_id, chunk.source)
+
+    # The old summary describes the old text.
+    summary = target.doc_summaries.get(doc_id)
+    size = len(target)
+    unindexed: List[DocChunk] = []
+    try:
+        target.append(new_chunks)
+        target.delete_rows(dropped)
+        unindexed = target.drop_unindexed(doc_id)
+        target.set_summary(doc_id, None)
+        _persist_or_defer(target, flush)
+    except Exception:
+        target.unindexed.extend(unindexed)
+        target.restore_rows(dropped)
+        target.rollback_append(size)
+        for row, source, title, url in previous_meta:
+            chunk = target.chunks[row]
+            chunk.source, chunk.title, chunk.url = source, title, url
+            target.index.set_label([row], source)
+            target.centroids.set_label(doc_id, source)
+        target.set_summary(doc_id, summary)
+        raise
+
+    _evict()
+    return [target.chunks[row] for row, _ in kept] + new_chunks
+
+
+def set_document_summary(
+    doc_id: UUID,
+    text: str,
+    embedding: List[float],
+    collection: Optional[str] = None,
+) -> bool:
+    """
+    Attach a generated summary and its embedding to a live document. The summary
+    vector routes coarse search alongside the document's centroid.
+    """
+    target = _existing_collection(collection)
+    if target is None or not target.document_rows(doc_id):
+        return False
+    previous = target.doc_summaries.get(doc_id)
+    target.set_summary(doc_id, {"text": text, "embedding": embedding})
+    try:
+        _persist(target)
+    except Exception:
+        target.set_summary(doc_id, previous)
+        raise
+    return True
+
+
+def compact(collection: Optional[str] = None) -> int:
+    """Drop tombstoned rows from memory. Returns how many rows were reclaimed."""
+    target = _existing_collection(collection)
+    return target.compact() if target is not None else 0
+
+
+def maybe_compact(collection: Optional[str] = None) -> int:
+    """Compact if tombstones exceed COMPACT_RATIO of the index."""
+    target = _existing_collection(collection)
+    if target is None:
+        return 0
+    index = target.index
+    if index.dead and index.dead >= COMPACT_RATIO * len(index):
+        return compact(collection)
+    return 0
+
+
+def get_docs(source: Optional[str] = None, collection: Optional[str] = None) -> List[DocChunk]:
+    """Get live document chunks, optionally filtered by source."""
+    target = _existing_collection(collection)
+    if target is None:
+        return []
+    chunks = [target.chunks[row] for row in target.live_rows()]
     if source is None:
-        return _doc_chunks.copy()
-    return [chunk for chunk in _doc_chunks if chunk.source == source]
+        return chunks
+    return [chunk for chunk in chunks if chunk.source == source]
 
 
-def increment_questions_count() -> None:
-    """Increment the questions count."""
-    global _questions_count
-    _questions_count += 1
-    _save_state()
+def search(
+    query_embedding: List[float],
+    top_k: int,
+    sources: Optional[List[str]] = None,
+    collection: Optional[str] = None,
+) -> List[Tuple[float, DocChunk]]:
+    """
+    Return the top_k (score, chunk) pairs by cosine similarity, best first.
+    Only the given collection's matrix is scored; an unknown collection has no results.
+
+    Once a collection holds COARSE_MIN_DOCS documents, search is coarse-to-fine:
+    the COARSE_DOCS documents whose centroid (or summary) best matches the query
+    are picked first, and only their chunks are scored.
+    """
+    target = _existing_collection(collection)
+    if target is None:
+        return []
+    if COARSE_DOCS > 0 and len(target.centroids) >= COARSE_MIN_DOCS:
+        return _coarse_search(target, query_embedding, top_k, sources)
+    mask = target.index.alive
+    if sources:
+        mask = mask & target.index.label_mask(sources)
+    return [
+        (score, target.chunks[row])
+        for row, score in target.index.top_k(query_embedding, top_k, mask, RERANK_FACTOR)
+    ]
+
+
+def _coarse_search(
+    target: Collection,
+    query_embedding: List[float],
+    top_k: int,
+    sources: Optional[List[str]],
+) -> List[Tuple[float, DocChunk]]:
+    wanted = set(sources or ())
+    allowed = None
+    if wanted:
+        allowed = np.fromiter(
+            (label in wanted for label in target.centroids.labels),
+            dtype=bool,
+            count=len(target.centroids),
+        )
+    rows = [
+        row
+        for doc_id in target.centroids.top(query_embedding, COARSE_DOCS, allowed)
+        for row in target.document_rows(doc_id)
+        if not wanted or target.chunks[row].source in wanted
+    ]
+    return [
+        (score, target.chunks[row])
+        for row, score in target.index.top_k_among(query_embedding, rows, top_k)
+    ]
+
+
+# Collections with a projection fit in progress.
+_refitting: Set[str] = set()
+
+
+async def refit_projection(collection: Optional[str] = None) -> bool:
+    """
+    Fit a new PROJECTION_METHOD projection for a collection if it is due. The SVD
+    and the projection of existing rows run in a worker thread; the result is
+    discarded if the index was compacted meanwhile. Returns True if installed.
+    """
+    name = collection or DEFAULT_COLLECTION
+    target = _existing_collection(collection)
+    if (
+        PROJECTION_METHOD == "off"
+        or target is None
+        or name in _refitting
+        or not target.index.needs_refit(PROJECTION_MIN_ROWS, PROJECTION_REFIT_GROWTH)
+    ):
+        return False
+    index = target.index
+    _refitting.add(name)
+    try:
+        version, size = index.version, len(index)
+        rows = index.matrix  # rows below `size` never change without a version bump
+        live = np.flatnonzero(index.alive)
+        if len(live) > PROJECTION_SAMPLE_ROWS:
+            live = np.random.default_rng(size).choice(live, PROJECTION_SAMPLE_ROWS, replace=False)
+        sample = rows[live]
+        projection = await asyncio.to_thread(fit_projection, sample, PROJECTION_DIM, PROJECTION_METHOD)
+        reduced = await asyncio.to_thread(np.matmul, rows, projection)
+        return index.install_projection(projection, reduced, size, version)
+    finally:
+        _refitting.discard(name)
+
+
+def _current_bucket(now: float) -> Dict[str, int]:
+    start = int(now // ROLLUP_BUCKET_SECONDS) * ROLLUP_BUCKET_SECONDS
+    bucket = _rollups.get(start)
+    if bucket is None:
+        bucket = _rollups[start] = {"questions": 0, "feedback": 0, "positive": 0, "negative": 0}
+        if start < max(_rollups):
+            # Replayed feedback can predate buckets rebuilt from the question log.
+            for key in sorted(_rollups):
+                _rollups.move_to_end(key)
+        while len(_rollups) > ROLLUP_BUCKETS:
+            _rollups.popitem(last=False)
+    return bucket
+
+
+def increment_questions_count(
+    collection: Optional[str] = None,
+    cited: Iterable[DocChunk] = (),
+) -> None:
+    """
+    Count a question (per collection too, if it exists) and one citation for each
+    document the chunks retrieved for it came from. Recorded with a single append.
+    """
+    name = collection or DEFAULT_COLLECTION
+    documents: Dict[str, str] = {}
+    for chunk in cited:
+        documents.setdefault(str(chunk.doc_id), chunk.title)
+    event = {
+        "ts": time.time(),
+        "collection": name if _existing_collection(name) is not None else None,
+        "cited": [[doc_id, title] for doc_id, title in documents.items()],
+    }
+    _apply_analytics_event(event)
+    _log_analytics_event(event)
+    _event_recorded()
 
 
 def add_feedback(
@@ -134,30 +958,122 @@ def add_feedback(
     rating: int,
     comment: Optional[str] = None,
 ) -> None:
-    """Add feedback to the feedback list."""
-    _feedback_list.append(
-        {
-            "question": question,
-            "answer": answer,
-            "rating": rating,
-            "comment": comment,
-        }
-    )
-    _save_state()
+    """Append feedback to the feedback log and update the counters."""
+    entry = {
+        "question": question,
+        "answer": answer,
+        "rating": rating,
+        "comment": comment,
+        "ts": time.time(),
+    }
+    _apply_feedback(entry)
+    _append_feedback_log([entry])
+    _event_recorded()
+
+
+def _forget_citations(doc_id: UUID, collection: str) -> None:
+    """Drop a deleted document from the citation counts, in memory and in the log."""
+    entry = _citations.get(str(doc_id))
+    if entry is None or entry["collection"] != collection:
+        return
+    event = {"forget": str(doc_id)}
+    _apply_analytics_event(event)
+    _log_analytics_event(event)
+    _event_recorded()
+
+
+def _apply_analytics_event(event: Dict[str, Any]) -> None:
+    global _questions_count
+    if "forget" in event:
+        if _citations.pop(event["forget"], None) is not None and event["forget"] in _top_cited:
+            _rebuild_top_cited()
+        return
+    _questions_count += 1
+    name = event.get("collection")
+    if name is not None:
+        _collection_questions[name] = _collection_questions.get(name, 0) + 1
+    _current_bucket(event["ts"])["questions"] += 1
+    for key, title in event["cited"]:
+        entry = _citations.setdefault(
+            key,
+            {"doc_id": key, "title": title, "collection": name or DEFAULT_COLLECTION, "citations": 0},
+        )
+        entry["title"] = title
+        entry["citations"] += 1
+        _update_top_cited(key)
+
 
+def _apply_feedback(entry: Dict[str, Any]) -> None:
+    bucket = _current_bucket(entry["ts"])
+    _feedback_counts["total"] += 1
+    bucket["feedback"] += 1
+    if entry.get("rating") in (1, -1):
+        key = "positive" if entry["rating"] == 1 else "negative"
+        _feedback_counts[key] += 1
+        bucket[key] += 1
 
-def get_stats() -> Dict[str, int]:
-    """Get statistics about questions and feedback."""
-    positive_feedback = sum(1 for fb in _feedback_list if fb["rating"] == 1)
-    negative_feedback = sum(1 for fb in _feedback_list if fb["rating"] == -1)
 
+def _update_top_cited(key: str) -> None:
+    # Counts only ever grow by one, so a document can only enter the list by
+    # overtaking its current last entry.
+    if key not in _top_cited:
+        if len(_top_cited) < TOP_CITED:
+            _top_cited.append(key)
+        elif _citations[key]["citations"] > _citations[_top_cited[-1]]["citations"]:
+            _top_cited[-1] = key
+        else:
+            return
+    _top_cited.sort(key=lambda k: -_citations[k]["citations"])
+
+
+def _rebuild_top_cited() -> None:
+    _top_cited[:] = heapq.nlargest(TOP_CITED, _citations, key=lambda k: _citations[k]["citations"])
+
+
+def list_collections() -> List[Dict[str, Any]]:
+    """Per-collection sizes and question counts, including collections not in memory."""
+    names = [DEFAULT_COLLECTION] + sorted(set(_collection_summaries) | set(_collections))
+    collections = []
+    for name in names:
+        if name == DEFAULT_COLLECTION:
+            summary = _default.summary()
+        elif name in _collections:
+            summary = _collections[name].summary()
+        else:
+            summary = _collection_summaries[name]
+        collections.append(
+            {
+                "name": name,
+                "documents": summary["documents"],
+                "chunks": summary["chunks"],
+                "questions": _collection_questions.get(name, 0),
+                "loaded": name == DEFAULT_COLLECTION or name in _collections,
+            }
+        )
+    return collections
+
+
+def get_stats() -> Dict[str, Any]:
+    """Get statistics about questions, feedback and collections."""
     return {
         "total_questions": _questions_count,
-        "total_feedback": len(_feedback_list),
-        "positive_feedback": positive_feedback,
-        "negative_feedback": negative_feedback,
+        "total_feedback": _feedback_counts["total"],
+        "positive_feedback": _feedback_counts["positive"],
+        "negative_feedback": _feedback_counts["negative"],
+        "collections": list_collections(),
     }
 
 
-_load_state()
+def get_analytics() -> Dict[str, Any]:
+    """
+    Question and feedback counts per time bucket (oldest first) and the most
+    cited documents. Both are maintained as events arrive, so reading is cheap.
+    """
+    return {
+        "bucket_seconds": ROLLUP_BUCKET_SECONDS,
+        "buckets": [{"start": start, **counts} for start, counts in _rollups.items()],
+        "top_documents": [dict(_citations[key]) for key in _top_cited],
+    }
 
+
+_load_state()
@@ -0,0 +1,419 @@
+"""
+Offline Wikipedia dump ingestion.
+
+Streams a local MediaWiki XML export or a JSONL dump (one {"title", "text", "url"}
+object per line, e.g. WikiExtractor output), strips markup, chunks and bulk-embeds
+the articles and loads them into the store tagged source="wikipedia".
+
+Usage:
+    python -m app.wiki_dump enwiki-pages-articles.xml --workers 4 --checkpoint ckpt.json
+
+Run it while the API server is stopped: both processes rewrite the same store file.
+"""
+import argparse
+import asyncio
+import bz2
+import gzip
+import importlib
+import itertools
+import json
+import logging
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+from uuid import NAMESPACE_URL, UUID, uuid5
+
+from . import scheduler, store
+from .rag import split_into_chunks
+
+logger = logging.getLogger(__name__)
+
+Embedder = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+DEFAULT_BASE_URL = "https://en.wikipedia.org/wiki/"
+DEFAULT_EMBEDDER = "app.rag:get_embeddings"
+
+
+@dataclass
+class WikiPage:
+    title: str
+    text: str
+    url: Optional[str] = None
+
+
+# ---------------------------------------------------------------------------
+# Markup stripping
+# ---------------------------------------------------------------------------
+
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_REF_RE = re.compile(r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE)
+_TEMPLATE_RE = re.compile(r"\{\{[^{}]*\}\}")
+_TABLE_RE = re.compile(r"\{\|[^{}]*?\|\}", re.DOTALL)
+_FILE_LINK_RE = re.compile(
+    r"\[\[(?:File|Image|Category|Media):[^\[\]]*(?:\[\[[^\[\]]*\]\][^\[\]]*)*\]\]",
+    re.IGNORECASE,
+)
+_PIPED_LINK_RE = re.compile(r"\[\[[^\[\]|]*\|([^\[\]]*)\]\]")
+_LINK_RE = re.compile(r"\[\[([^\[\]]*)\]\]")
+_EXT_LINK_RE = re.compile(r"\[https?://[^\s\]]+\s*([^\]]*)\]")
+_HEADING_RE = re.compile(r"^=+\s*(.*?)\s*=+\s*$", re.MULTILINE)
+_EMPHASIS_RE = re.compile(r"'{2,}")
+_TAG_RE = re.compile(r"<[^>]+>")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def strip_wiki_markup(text: str) -> str:
+    """
+    Reduce MediaWiki markup to plain paragraphs. Regex-based, so it is an
+    approximation, but good enough for retrieval context.
+    """
+    text = _COMMENT_RE.sub("", text)
+    text = _REF_RE.sub("", text)
+    # Templates and tables nest; strip innermost first until nothing changes.
+    previous = None
+    while previous != text:
+        previous = text
+        text = _TEMPLATE_RE.sub("", text)
+        text = _TABLE_RE.sub("", text)
+    text = _FILE_LINK_RE.sub("", text)
+    text = _PIPED_LINK_RE.sub(r"\1", text)
+    text = _LINK_RE.sub(r"\1", text)
+    text = _EXT_LINK_RE.sub(r"\1", text)
+    text = _HEADING_RE.sub(r"\1", text)
+    text = _EMPHASIS_RE.sub("", text)
+    text = _TAG_RE.sub("", text)
+    lines = [line.strip() for line in text.split("\n")]
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def page_url(title: str, base_url: str = DEFAULT_BASE_URL) -> str:
+    return base_url + quote(title.replace(" ", "_"), safe="/:()',")
+
+
+# ---------------------------------------------------------------------------
+# Streaming readers
+# ---------------------------------------------------------------------------
+
+def _open_dump(path: Path) -> IO[bytes]:
+    if path.suffix == ".bz2":
+        return bz2.open(path, "rb")
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return path.open("rb")
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_xml_pages(fp: IO[bytes], base_url: str = DEFAULT_BASE_URL) -> Iterator[WikiPage]:
+    """
+    Yield main-namespace, non-redirect pages from a MediaWiki XML export.
+    Finished <page> elements are cleared from the tree so memory stays constant.
+    """
+    context = ET.iterparse(fp, events=("start", "end"))
+    root = None
+    for event, elem in context:
+        if root is None and event == "start":
+            root = elem
+        if event != "end" or _local_name(elem.tag) != "page":
+            continue
+
+        title, ns, text, redirect = "", "0", "", False
+        for child in elem.iter():
+            name = _local_name(child.tag)
+            if name == "title":
+                title = child.text or ""
+            elif name == "ns":
+                ns = (child.text or "0").strip()
+            elif name == "redirect":
+                redirect = True
+            elif name == "text":
+                text = child.text or ""
+
+        elem.clear()
+        if root is not None:
+            root.clear()
+
+        if ns != "0" or redirect or not title:
+            continue
+        yield WikiPage(title=title, text=text, url=page_url(title, base_url))
+
+
+def iter_jsonl_pages(fp: IO[bytes], base_url: str = DEFAULT_BASE_URL) -> Iterator[WikiPage]:
+    """Yield pages from a JSONL dump, one article object per line."""
+    for line_no, line in enumerate(fp, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            raw = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning("Skipping malformed JSONL line %d", line_no)
+            continue
+        title = raw.get("title") or ""
+        if not title:
+            continue
+        yield WikiPage(
+            title=title,
+            text=raw.get("text") or "",
+            url=raw.get("url") or page_url(title, base_url),
+        )
+
+
+def iter_dump_pages(
+    path: Path,
+    fmt: Optional[str] = None,
+    base_url: str = DEFAULT_BASE_URL,
+) -> Iterator[WikiPage]:
+    """Stream pages from a dump file; the format is inferred from the name if omitted."""
+    if fmt is None:
+        fmt = "jsonl" if ".jsonl" in path.suffixes or ".json" in path.suffixes else "xml"
+    reader = iter_jsonl_pages if fmt == "jsonl" else iter_xml_pages
+    with _open_dump(path) as fp:
+        yield from reader(fp, base_url)
+
+
+# ---------------------------------------------------------------------------
+# Chunk + embed (runs in worker processes)
+# ---------------------------------------------------------------------------
+
+ChunkRow = Tuple[str, List[float], str, Optional[str]]  # text, embedding, title, url
+
+
+def resolve_embedder(spec: str) -> Embedder:
+    """Resolve a "module:function" path to an async embedder callable."""
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"Embedder must look like 'module:function', got {spec!r}")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def process_pages(
+    pages: List[WikiPage],
+    embedder: Embedder,
+    max_chunks: int = 5,
+    embed_batch_size: int = 32,
+) -> List[ChunkRow]:
+    """Strip, chunk and embed a batch of pages. Must stay picklable for process pools."""
+    pending: List[Tuple[str, str, Optional[str]]] = []
+    for page in pages:
+        chunks = [c for c in split_into_chunks(strip_wiki_markup(page.text)) if c.strip()]
+        if max_chunks > 0:
+            chunks = chunks[:max_chunks]
+        pending.extend((chunk, page.title, page.url) for chunk in chunks)
+
+    async def _embed_all() -> List[List[float]]:
+        embeddings: List[List[float]] = []
+        for start in range(0, len(pending), embed_batch_size):
+            batch = [text for text, _, _ in pending[start:start + embed_batch_size]]
+            embeddings.extend(await embedder(batch))
+        return embeddings
+
+    embeddings = asyncio.run(_embed_all()) if pending else []
+    return [
+        (text, emb, title, url)
+        for (text, title, url), emb in zip(pending, embeddings)
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Checkpointing
+# ---------------------------------------------------------------------------
+
+def _read_checkpoint(path: Optional[Path], dump: Path) -> int:
+    if path is None or not path.exists():
+        return 0
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (json.JSONDecodeError, OSError):
+        return 0
+    if data.get("dump") != str(dump.resolve()):
+        logger.warning("Checkpoint %s belongs to another dump; starting over", path)
+        return 0
+    return int(data.get("pages_done", 0))
+
+
+def _write_checkpoint(path: Optional[Path], dump: Path, pages_done: int) -> None:
+    if path is None:
+        return
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(
+        json.dumps({"dump": str(dump.resolve()), "pages_done": pages_done}),
+        encoding="utf-8",
+    )
+    tmp.replace(path)
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+def _batched(pages: Iterator[WikiPage], size: int) -> Iterator[List[WikiPage]]:
+    batch: List[WikiPage] = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _InlineExecutor(Executor):
+    """Runs work synchronously; used when workers == 1."""
+
+    def submit(self, fn, /, *args, **kwargs):  # type: ignore[override]
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
+def _load_rows(rows: List[ChunkRow], collection: Optional[str] = None) -> int:
+    """
+    Add a committed batch to the store without flushing it. Articles get a stable
+    doc_id, so one that is already stored (a re-run, or a repeat within the dump)
+    replaces its old chunks instead of duplicating them.
+    """
+    articles: Dict[UUID, List[Dict[str, Any]]] = {}
+    for text, embedding, title, url in rows:
+        doc_id = uuid5(NAMESPACE_URL, url or title)
+        articles.setdefault(doc_id, []).append(
+            {"text": text, "embedding": embedding, "source": "wikipedia", "title": title, "url": url}
+        )
+
+    new_rows: List[Dict[str, Any]] = []
+    for doc_id, items in articles.items():
+        if store.get_document(doc_id, collection):
+            store.replace_document(doc_id, items, collection=collection, flush=False)
+        else:
+            new_rows.extend({**item, "doc_id": doc_id} for item in items)
+    store.add_doc_chunks(new_rows, collection=collection, flush=False)
+    return len(rows)
+
+
+def ingest_dump(
+    path: Path,
+    embedder: Embedder,
+    fmt: Optional[str] = None,
+    workers: int = 1,
+    batch_pages: int = 16,
+    max_chunks: int = 5,
+    embed_batch_size: int = 32,
+    checkpoint: Optional[Path] = None,
+    limit: Optional[int] = None,
+    base_url: str = DEFAULT_BASE_URL,
+    collection: Optional[str] = None,
+    flush_every: int = 1024,
+) -> Tuple[int, int]:
+    """
+    Ingest a dump into the store. Returns (pages_processed, chunks_stored) for this run.
+
+    Page batches are chunked and embedded across `workers` processes, but results are
+    committed in dump order. The store is written every `flush_every` pages and once
+    at the end, and the checkpoint only advances after such a write, so it is always
+    a safe resume point.
+    """
+    pages_done = _read_checkpoint(checkpoint, path)
+    if pages_done:
+        logger.info("Resuming %s after %d page(s)", path, pages_done)
+
+    pages: Iterator[WikiPage] = iter_dump_pages(path, fmt, base_url)
+    for _ in range(pages_done):
+        if next(pages, None) is None:
+            break
+    if limit is not None:
+        pages = itertools.islice(pages, max(limit - pages_done, 0))
+
+    executor: Executor = (
+        # Every worker has its own upstream bucket; split the quota between them.
+        ProcessPoolExecutor(workers, initializer=scheduler.share_quota, initargs=(workers,))
+        if workers > 1
+        else _InlineExecutor()
+    )
+    in_flight: Deque[Tuple[int, Future]] = deque()
+    run_pages = 0
+    run_chunks = 0
+    flushed_at = pages_done
+
+    def _flush() -> None:
+        nonlocal flushed_at
+        store.flush(collection)
+        _write_checkpoint(checkpoint, path, pages_done)
+        flushed_at = pages_done
+        logger.info("Ingested %d page(s), %d chunk(s) so far", run_pages, run_chunks)
+
+    def _commit_oldest() -> None:
+        nonlocal pages_done, run_pages, run_chunks
+        size, future = in_flight.popleft()
+        run_chunks += _load_rows(future.result(), collection)
+        pages_done += size
+        run_pages += size
+        if pages_done - flushed_at >= flush_every:
+            _flush()
+
+    try:
+        for batch in _batched(pages, batch_pages):
+            future = executor.submit(process_pages, batch, embedder, max_chunks, embed_batch_size)
+            in_flight.append((len(batch), future))
+            # Bound in-flight work so memory does not grow with the dump size.
+            while len(in_flight) > max(workers, 1) * 2:
+                _commit_oldest()
+        while in_flight:
+            _commit_oldest()
+        if pages_done != flushed_at:
+            _flush()
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return run_pages, run_chunks
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Ingest an offline Wikipedia dump into the store.")
+    parser.add_argument("dump", type=Path, help="MediaWiki XML or JSONL dump (optionally .bz2/.gz)")
+    parser.add_argument("--format", choices=["xml", "jsonl"], default=None)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-pages", type=int, default=16)
+    parser.add_argument("--max-chunks", type=int, default=5, help="Chunks kept per article (0 = all)")
+    parser.add_argument("--embed-batch-size", type=int, default=32)
+    parser.add_argument("--checkpoint", type=Path, default=None)
+    parser.add_argument(
+        "--flush-every", type=int, default=1024, help="Pages between store writes and checkpoints"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many pages")
+    parser.add_argument("--embedder", default=DEFAULT_EMBEDDER, help="Async embedder as module:function")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--collection", default=None, help="Target collection (default collection if omitted)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    pages, chunks = ingest_dump(
+        args.dump,
+        embedder=resolve_embedder(args.embedder),
+        fmt=args.format,
+        workers=args.workers,
+        batch_pages=args.batch_pages,
+        max_chunks=args.max_chunks,
+        embed_batch_size=args.embed_batch_size,
+        checkpoint=args.checkpoint,
+        limit=args.limit,
+        base_url=args.base_url,
+        collection=args.collection,
+        flush_every=args.flush_every,
+    )
+    logger.info("Done: %d page(s), %d chunk(s) stored", pages, chunks)
+
+
+if __name__ == "__main__":
+    main()
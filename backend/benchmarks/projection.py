@@ -0,0 +1,82 @@
+"""
+Retrieval with a reduced-dimension index vs full-dimension scoring: per-query
+latency, index memory and recall@k of the projected search (with full-dimension
+re-ranking) against the exact top-k.
+
+Usage (from backend/):
+    python -m benchmarks.projection --rows 50000 --dim 1024 --reduced 256
+
+The corpus is synthetic: unit vectors with a power-law spectrum, roughly how
+sentence embeddings spread their variance, queried with perturbed corpus rows.
+"""
+import argparse
+import time
+from typing import List
+
+import numpy as np  # type: ignore[import-not-found]
+
+from app.index import EmbeddingIndex, fit_projection
+
+
+def synthetic_corpus(rows: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    spectrum = 1.0 / np.arange(1, dim + 1) ** 0.8
+    basis, _ = np.linalg.qr(rng.standard_normal((dim, dim)))
+    return ((rng.standard_normal((rows, dim)) * spectrum) @ basis.T).astype(np.float32)
+
+
+def recall(found: List[List[int]], exact: List[List[int]]) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, exact))
+    return hits / sum(len(e) for e in exact)
+
+
+def timed_search(index: EmbeddingIndex, queries: np.ndarray, k: int, rerank_factor: int):
+    started = time.perf_counter()
+    results = [[row for row, _ in index.top_k(q, k, rerank_factor=rerank_factor)] for q in queries]
+    return results, (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--reduced", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, nargs="+", default=[4, 8])
+    args = parser.parse_args(argv)
+
+    corpus = synthetic_corpus(args.rows, args.dim)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(args.rows, args.queries, replace=False)
+    queries = [
+        (corpus[i] + 0.3 * np.linalg.norm(corpus[i]) * rng.standard_normal(args.dim) / np.sqrt(args.dim)).tolist()
+        for i in picks
+    ]
+
+    index = EmbeddingIndex()
+    index.add(corpus.tolist())
+    full_mb = index.matrix.nbytes / 2**20
+    exact, full_ms = timed_search(index, queries, args.k, 1)
+
+    print(f"{args.rows} rows x {args.dim}-d, {args.queries} queries, k={args.k}")
+    print(f"{'index':<22} {'query ms':>9} {'index MB':>9} {'recall@k':>9} {'fit s':>7}")
+    print(f"{'full ' + str(args.dim) + '-d':<22} {full_ms:>9.2f} {full_mb:>9.1f} {1.0:>9.3f} {'-':>7}")
+
+    sample = index.matrix[rng.choice(args.rows, min(args.rows, 20000), replace=False)]
+    for method in ("pca", "random"):
+        started = time.perf_counter()
+        projection = fit_projection(sample, args.reduced, method)
+        reduced = index.matrix @ projection
+        fit_s = time.perf_counter() - started
+        index.install_projection(projection, reduced, len(index), index.version)
+        reduced_mb = reduced.nbytes / 2**20
+        for factor in args.rerank_factor:
+            found, ms = timed_search(index, queries, args.k, factor)
+            label = f"{method} {args.reduced}-d x{factor}"
+            # Memory column: the reduced matrix added on top of the full one kept for re-ranking.
+            print(f"{label:<22} {ms:>9.2f} {'+' + format(reduced_mb, '.1f'):>9} {recall(found, exact):>9.3f} {fit_s:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
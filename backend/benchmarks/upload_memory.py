@@ -0,0 +1,108 @@
+"""
+Peak memory of the PDF upload path: buffered (whole upload, joined text) vs streamed
+(spooled to disk, pages chunked one at a time, chunks handled one embedding batch
+at a time).
+
+Usage (from backend/):
+    python -m benchmarks.upload_memory --pages 400
+
+Embedding and storage are left out; both paths stop at the chunks that would be
+sent to the embeddings API (one list for buffered, EMBED_BATCH_SIZE batches for streamed). Peak is the Python heap as reported by tracemalloc.
+"""
+import argparse
+import asyncio
+import io
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from pypdf import PdfReader  # type: ignore[import-not-found]
+from starlette.datastructures import UploadFile  # type: ignore[import-not-found]
+
+from app import main as api, rag
+
+
+def write_pdf(path: Path, pages: int, lines_per_page: int = 50) -> None:
+    """Write a plain text-only PDF with `pages` pages of Helvetica text."""
+    objects: List[bytes] = []
+    page_ids = [4 + 2 * n for n in range(pages)]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids).encode()
+    objects.append(b"<< /Type /Pages /Kids [" + kids + b"] /Count " + str(pages).encode() + b" >>")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for n in range(pages):
+        lines = b"".join(
+            f"(Page {n} line {i}: the mitochondrion is the powerhouse of the cell.) '\n".encode()
+            for i in range(lines_per_page)
+        )
+        stream = b"BT /F1 9 Tf 40 800 Td 14 TL\n" + lines + b"ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_ids[n] + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    path.write_bytes(out.getvalue())
+
+
+async def buffered(path: Path, max_chunks: int) -> int:
+    """The previous implementation: read the upload, join every page, then chunk."""
+    with path.open("rb") as fp:
+        upload = UploadFile(fp)
+        raw_bytes = await upload.read()
+    reader = PdfReader(io.BytesIO(raw_bytes))
+    full_text = "\n\n".join(page.extract_text() or "" for page in reader.pages)
+    return len(rag._prepare_chunks("bench", full_text.split("\n"), max_chunks))
+
+
+async def streamed(path: Path, max_chunks: int) -> int:
+    """The current implementation: spool to disk, chunk page by page, batch by batch."""
+    with path.open("rb") as fp, tempfile.TemporaryFile() as spooled:
+        await api._spool_upload(UploadFile(fp), spooled)
+        reader = PdfReader(spooled)
+        lines = rag._page_lines(api._iter_pdf_pages(reader))
+        batches = rag._batched(rag._iter_doc_chunks("bench", lines, max_chunks), rag.EMBED_BATCH_SIZE)
+        return sum(len(batch) for batch in batches)
+
+
+def measure(fn: Callable, path: Path, max_chunks: int) -> Tuple[int, float, float]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    chunks = asyncio.run(fn(path, max_chunks))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, peak / 2**20, elapsed
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=400)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.pdf"
+        write_pdf(path, args.pages)
+        print(f"{args.pages} pages, {path.stat().st_size / 2**20:.1f} MB on disk")
+        print(f"{'path':<10} {'max_chunks':>10} {'chunks':>8} {'peak MB':>9} {'seconds':>8}")
+        for max_chunks in (rag.MAX_DOC_CHUNKS, 0):
+            for name, fn in (("buffered", buffered), ("streamed", streamed)):
+                chunks, peak, elapsed = measure(fn, path, max_chunks)
+                print(f"{name:<10} {max_chunks or 'all':>10} {chunks:>8} {peak:>9.1f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
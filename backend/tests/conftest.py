@@ -0,0 +1,34 @@
+import importlib
+
+import pytest
+
+from app import rag
+from app.coalesce import MicroBatcher, SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def fresh_coalescers(monkeypatch):
+    """Give every test its own in-flight table and query batcher."""
+    batcher = rag._query_batcher
+    monkeypatch.setattr(rag, "_single_flight", SingleFlight())
+    monkeypatch.setattr(
+        rag,
+        "_query_batcher",
+        MicroBatcher(batcher._fn, window=batcher.window, max_batch=batcher.max_batch),
+    )
+
+
+@pytest.fixture
+def fresh_store(tmp_path, monkeypatch):
+    """Reload app.store against tmp_path/store.json; reload it again to re-read from disk."""
+    monkeypatch.setenv("STUDYBUDDY_STORE_PATH", str(tmp_path / "store.json"))
+    return importlib.reload(importlib.import_module("app.store"))
+
+
+@pytest.fixture
+def store_flushes(fresh_store, monkeypatch):
+    """One entry per write of the default collection to store.json."""
+    flushes = []
+    original_save = fresh_store._save_state
+    monkeypatch.setattr(fresh_store, "_save_state", lambda: (flushes.append(1), original_save()))
+    return flushes
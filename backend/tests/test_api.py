@@ -10,13 +10,20 @@ from app.main import app, rag
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def isolated_store(fresh_store):
+    """Keep API tests from writing to the real app/data store."""
+    return fresh_store
+
+
 def test_upload_pdf_success(monkeypatch):
     captured = {}
 
-    async def fake_store_text(title, text, source, max_chunks=None):
+    async def fake_store_pages(title, pages, source, max_chunks=None, doc_id=None, collection=None):
         captured["title"] = title
-        captured["text"] = text
+        captured["text"] = "\n\n".join(pages)
         captured["source"] = source
+        return [uuid4()]
 
     class FakePage:
         def extract_text(self):
@@ -27,7 +34,7 @@ def test_upload_pdf_success(monkeypatch):
             self.pages = [FakePage()]
 
     monkeypatch.setattr("app.main.PdfReader", FakePdfReader)
-    monkeypatch.setattr(rag, "store_text", fake_store_text)
+    monkeypatch.setattr(rag, "store_pages", fake_store_pages)
 
     response = client.post(
         "/api/upload-pdf",
@@ -37,6 +44,7 @@ def test_upload_pdf_success(monkeypatch):
 
     assert response.status_code == 200
     assert response.json()["status"] == "ok"
+    assert response.json()["doc_id"]
     assert captured["title"] == "Test PDF"
     assert captured["source"] == "user"
     assert "Sample PDF text" in captured["text"]
@@ -63,19 +71,80 @@ def test_upload_pdf_rejects_empty(monkeypatch):
     assert "Could not extract text" in response.json()["detail"]
 
 
-def test_chat_endpoint(monkeypatch):
-    async def fake_rag_answer(question, top_k=3, sources=None):
+def test_upload_pdf_rejects_files_over_the_size_cap(monkeypatch):
+    monkeypatch.setattr("app.main.MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr("app.main.UPLOAD_CHUNK_BYTES", 256)
+
+    def unreachable(_file_like):
+        raise AssertionError("an oversized upload must not be parsed")
+
+    monkeypatch.setattr("app.main.PdfReader", unreachable)
+
+    response = client.post(
+        "/api/upload-pdf",
+        data={"title": "Huge PDF"},
+        files={"file": ("huge.pdf", b"%PDF-1.4 " + b"x" * 4096, "application/pdf")},
+    )
+
+    assert response.status_code == 413
+
+
+def test_upload_pdf_stops_reading_pages_at_the_chunk_limit(monkeypatch):
+    read = []
+
+    class CountingPage:
+        def __init__(self, number):
+            self.number = number
+
+        def extract_text(self):
+            read.append(self.number)
+            return f"Page {self.number} " + "x" * 600
+
+    class LazyPdfReader:
+        def __init__(self, file_like):
+            assert file_like.read(4) == b"%PDF"
+            self.pages = (CountingPage(n) for n in range(1000))
+
+    async def fake_get_embeddings(texts, priority=None):
+        return [[1.0, 0.0] for _ in texts]
+
+    monkeypatch.setattr("app.main.PdfReader", LazyPdfReader)
+    monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+    monkeypatch.setattr(
+        rag, "add_doc_chunks", lambda rows, collection=None, flush=True: [SimpleNamespace(id=uuid4()) for _ in rows]
+    )
+    monkeypatch.setattr(rag, "MAX_DOC_CHUNKS", 3)
+
+    response = client.post(
+        "/api/upload-pdf",
+        data={"title": "Long PDF"},
+        files={"file": ("long.pdf", b"%PDF-1.4 data", "application/pdf")},
+    )
+
+    assert response.status_code == 200
+    # Three chunks kept, a fourth to notice the truncation and one page of lookahead
+    # to close it; the remaining pages are never extracted.
+    assert len(read) == 5
+
+
+def _fake_answer(monkeypatch, doc_id=None):
+    async def fake_rag_answer(question, top_k=3, sources=None, collection=None, session=None, **retrieval):
         doc = SimpleNamespace(
             id=uuid4(),
             text="Chunk text",
             source="user",
             title="Doc Title",
             url=None,
+            doc_id=doc_id or uuid4(),
         )
         return ("Mock answer for " + question, [(0.92, doc)])
 
     monkeypatch.setattr(rag, "rag_answer", fake_rag_answer)
 
+
+def test_chat_endpoint(monkeypatch):
+    _fake_answer(monkeypatch)
+
     response = client.post(
         "/api/chat",
         json={"question": "What is 2+2?", "top_k": 1, "sources": ["user"]},
@@ -87,3 +156,125 @@ def test_chat_endpoint(monkeypatch):
     assert len(payload["context"]) == 1
     assert payload["context"][0]["meta"]["title"] == "Doc Title"
 
+
+def test_upload_bulk_returns_ids_per_document(monkeypatch):
+    calls = []
+
+    async def fake_store_texts(documents, max_chunks=None):
+        calls.append(documents)
+        return [[uuid4(), uuid4()], [uuid4()]]
+
+    monkeypatch.setattr(rag, "store_texts", fake_store_texts)
+
+    response = client.post(
+        "/api/upload-bulk",
+        json={
+            "documents": [
+                {"title": "Notes 1", "text": "First"},
+                {"title": "Notes 2", "text": "Second", "source": "wikipedia"},
+            ]
+        },
+    )
+
+    assert response.status_code == 200
+    payload = response.json()
+    assert len(calls) == 1
+    assert [d["title"] for d in payload["documents"]] == ["Notes 1", "Notes 2"]
+    assert [len(d["chunk_ids"]) for d in payload["documents"]] == [2, 1]
+    assert calls[0][1]["source"] == "wikipedia"
+
+
+def test_delete_unknown_document_returns_404():
+    response = client.delete(f"/api/documents/{uuid4()}")
+    assert response.status_code == 404
+
+
+def test_update_document_reports_reembedded_chunks(monkeypatch):
+    doc_id = uuid4()
+    chunk_id = uuid4()
+    monkeypatch.setattr(
+        "app.main.store.get_document",
+        lambda _doc_id, _collection=None: [SimpleNamespace(id=chunk_id)],
+    )
+
+    async def fake_update_document(doc_id_arg, title, text, source, collection=None):
+        assert doc_id_arg == doc_id
+        return [chunk_id], 0
+
+    monkeypatch.setattr(rag, "update_document", fake_update_document)
+
+    response = client.put(
+        f"/api/documents/{doc_id}",
+        json={"title": "Notes", "text": "Same text", "source": "user"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["reembedded"] == 0
+    assert response.json()["chunk_ids"] == [str(chunk_id)]
+
+
+def test_update_document_reads_collection_from_the_query(isolated_store, monkeypatch):
+    doc_id = uuid4()
+    isolated_store.add_doc_chunks(
+        [{"text": "Old", "embedding": [1.0, 0.0], "source": "user", "title": "Notes", "doc_id": doc_id}],
+        collection="bio",
+    )
+
+    async def fake_get_embeddings(texts, priority=None):
+        return [[0.0, 1.0] for _ in texts]
+
+    monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+    body = {"title": "Notes", "text": "New", "source": "user"}
+
+    response = client.put(f"/api/documents/{doc_id}?collection=bio", json=body)
+    assert response.status_code == 200
+    assert [c.text for c in isolated_store.get_document(doc_id, "bio")] == ["New"]
+
+    conflicting = client.put(f"/api/documents/{doc_id}?collection=bio", json={**body, "collection": "chem"})
+    assert conflicting.status_code == 400
+
+
+def test_chat_rejects_invalid_collection_name():
+    response = client.post(
+        "/api/chat",
+        json={"question": "Hi", "collection": "../other-tenant"},
+    )
+    assert response.status_code == 422
+
+
+def test_upstream_metrics_reports_every_priority_class():
+    response = client.get("/api/metrics/upstream")
+    assert response.status_code == 200
+    classes = response.json()["classes"]
+    assert set(classes) == {"interactive", "query", "bulk"}
+    assert {"queued", "granted", "shed", "wait_ms_p50", "wait_ms_p99"} <= set(classes["bulk"])
+
+
+def test_analytics_and_stats_count_chat_questions(monkeypatch):
+    doc_id = uuid4()
+    _fake_answer(monkeypatch, doc_id)
+    monkeypatch.setattr("app.store.time.time", lambda: 7300.0)
+
+    for question in ("What is 2+2?", "And 3+3?"):
+        assert client.post("/api/chat", json={"question": question}).status_code == 200
+
+    response = client.get("/api/analytics")
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["bucket_seconds"] == 3600
+    assert [(b["start"], b["questions"]) for b in payload["buckets"]] == [("1970-01-01T02:00:00Z", 2)]
+    assert payload["top_documents"] == [
+        {"doc_id": str(doc_id), "title": "Doc Title", "collection": "default", "citations": 2}
+    ]
+    assert client.get("/api/stats").json()["total_questions"] == 2
+
+
+def test_chat_rejects_out_of_range_min_score():
+    response = client.post("/api/chat", json={"question": "Hi", "min_score": 3})
+    assert response.status_code == 422
+
+
+def test_retrieval_metrics_lists_every_path():
+    response = client.get("/api/metrics/retrieval")
+    assert response.status_code == 200
+    assert set(response.json()) == {"full", "trimmed", "no_context"}
@@ -0,0 +1,142 @@
+import asyncio
+
+from app import rag
+from app.coalesce import MicroBatcher, SingleFlight
+
+
+class CountingEmbeddings:
+    """Local stand-in for _post_embeddings that records every upstream call."""
+
+    def __init__(self, delay=0.01):
+        self.calls = []
+        self.delay = delay
+        self.priorities = []
+
+    async def __call__(self, texts, priority=None):
+        self.priorities.append(priority)
+        self.calls.append(list(texts))
+        await asyncio.sleep(self.delay)
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_single_flight_shares_concurrent_calls_only():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        first = await asyncio.gather(*(flight.do("k", work) for _ in range(10)))
+        second = await flight.do("k", work)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == [1] * 10
+    assert second == 2
+    assert len(flight) == 0
+
+
+def test_micro_batcher_propagates_errors_to_every_waiter():
+    async def failing(items):
+        raise RuntimeError("upstream down")
+
+    async def main():
+        batcher = MicroBatcher(failing, window=0.005, max_batch=8)
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_identical_concurrent_queries_share_one_upstream_call(monkeypatch):
+    stub = CountingEmbeddings()
+    monkeypatch.setattr(rag, "_post_embeddings", stub)
+
+    async def main():
+        return await asyncio.gather(*(rag.get_embedding("What is osmosis?") for _ in range(30)))
+
+    results = asyncio.run(main())
+    assert stub.calls == [["What is osmosis?"]]
+    assert stub.priorities == [rag.Priority.QUERY]
+    assert all(r == results[0] for r in results)
+
+
+def test_distinct_concurrent_queries_are_micro_batched(monkeypatch):
+    stub = CountingEmbeddings()
+    monkeypatch.setattr(rag, "_post_embeddings", stub)
+    questions = [f"question {i}" * (i + 1) for i in range(5)]
+
+    async def main():
+        return await asyncio.gather(*(rag.get_embedding(q) for q in questions + questions))
+
+    results = asyncio.run(main())
+    assert len(stub.calls) == 1
+    assert sorted(stub.calls[0]) == sorted(questions)
+    assert results[:5] == [[float(len(q)), 1.0] for q in questions]
+    assert results[5:] == results[:5]
+
+
+def test_micro_batcher_flushes_early_when_full(monkeypatch):
+    stub = CountingEmbeddings()
+    monkeypatch.setattr(rag, "_post_embeddings", stub)
+    monkeypatch.setattr(rag._query_batcher, "max_batch", 2)
+
+    async def main():
+        await asyncio.gather(*(rag.get_embedding(f"q{i}") for i in range(5)))
+
+    asyncio.run(main())
+    assert [len(batch) for batch in stub.calls] == [2, 2, 1]
+
+
+def test_identical_concurrent_chat_calls_share_one_upstream_call(monkeypatch):
+    calls = []
+
+    async def fake_post_chat(payload):
+        calls.append(payload)
+        await asyncio.sleep(0.01)
+        return "shared answer"
+
+    monkeypatch.setattr(rag, "_post_chat", fake_post_chat)
+
+    async def main():
+        same = [rag.call_mistral_chat("Context: x\nQuestion: y") for _ in range(30)]
+        other = [rag.call_mistral_chat("Context: x\nQuestion: z")]
+        return await asyncio.gather(*same, *other)
+
+    answers = asyncio.run(main())
+    assert len(calls) == 2
+    assert answers == ["shared answer"] * 31
+
+
+def test_upstream_error_reaches_every_coalesced_caller(monkeypatch):
+    async def rate_limited(texts, priority=None):
+        await asyncio.sleep(0.01)
+        raise rag.HTTPException(status_code=503, detail="rate limit")
+
+    monkeypatch.setattr(rag, "_post_embeddings", rate_limited)
+
+    async def main():
+        return await asyncio.gather(*(rag.get_embedding("q") for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(getattr(r, "status_code", None) == 503 for r in results)
+
+
+def test_micro_batcher_recovers_from_a_previous_event_loop():
+    async def echo(items):
+        return list(items)
+
+    batcher = MicroBatcher(echo, window=10, max_batch=8)
+
+    async def abandon():
+        # The timer never fires: the loop closes while the item is still pending.
+        task = asyncio.ensure_future(batcher.submit("stale"))
+        await asyncio.sleep(0)
+        task.cancel()
+
+    asyncio.run(abandon())
+    batcher.window = 0.001
+    assert asyncio.run(batcher.submit("fresh")) == "fresh"
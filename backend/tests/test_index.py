@@ -0,0 +1,182 @@
+import asyncio
+import importlib
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from app.index import DocumentCentroids, EmbeddingIndex, fit_projection
+
+
+def _low_rank_corpus(n=2000, dim=64, rank=8, seed=0):
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dim))
+    return rng.standard_normal((n, rank)) @ basis + 0.01 * rng.standard_normal((n, dim))
+
+
+def test_pca_projection_with_rerank_matches_exact_search():
+    corpus = _low_rank_corpus()
+    index = EmbeddingIndex()
+    index.add(corpus.tolist())
+    queries = corpus[:20] + 0.05
+    exact = [index.top_k(q.tolist(), 5) for q in queries]
+
+    projection = fit_projection(index.matrix, dim=16)
+    assert index.install_projection(projection, index.matrix @ projection, len(index), index.version)
+    projected = [index.top_k(q.tolist(), 5, rerank_factor=4) for q in queries]
+
+    assert [[row for row, _ in r] for r in projected] == [[row for row, _ in r] for r in exact]
+    # Re-ranked scores are full-dimension cosines, not reduced-space estimates.
+    assert projected[0][0][1] == pytest.approx(exact[0][0][1], abs=1e-5)
+
+
+def test_rows_added_after_a_fit_are_projected_and_compaction_keeps_alignment():
+    corpus = _low_rank_corpus(n=300)
+    index = EmbeddingIndex()
+    index.add(corpus[:100].tolist())
+    projection = fit_projection(index.matrix, dim=16, method="random")
+    index.install_projection(projection, index.matrix @ projection, len(index), index.version)
+
+    index.add(corpus[100:].tolist())
+    index.delete(list(range(0, 300, 3)))
+    index.compact()
+
+    assert np.allclose(index._reduced[: len(index)], index.matrix @ projection, atol=1e-5)
+    best_row, score = index.top_k(index.matrix[7].tolist(), 1)[0]
+    assert best_row == 7 and score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_stale_fit_is_discarded_after_compaction():
+    index = EmbeddingIndex()
+    index.add(_low_rank_corpus(n=50).tolist())
+    version, size = index.version, len(index)
+    projection = fit_projection(index.matrix, dim=8)
+    reduced = index.matrix @ projection
+
+    index.delete([0, 1])
+    index.compact()
+
+    assert not index.install_projection(projection, reduced, size, version)
+    assert index.projection is None
+
+
+def test_label_mask_follows_adds_relabels_and_compaction():
+    index = EmbeddingIndex()
+    index.add([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], ["user", "wikipedia", "user"])
+    assert index.label_mask(["user"]).tolist() == [True, False, True]
+    assert not index.label_mask(["unknown"]).any()
+
+    index.set_label([2], "wikipedia")
+    index.delete([0])
+    index.compact()
+    assert index.label_mask(["wikipedia"]).tolist() == [True, True]
+    assert index.label_mask(["user", "wikipedia"]).all()
+
+
+def test_needs_refit_after_growth():
+    index = EmbeddingIndex()
+    index.add(_low_rank_corpus(n=100).tolist())
+    assert not index.needs_refit(min_rows=200, growth=0.5)
+    assert index.needs_refit(min_rows=50, growth=0.5)
+
+    projection = fit_projection(index.matrix, dim=8)
+    index.install_projection(projection, index.matrix @ projection, len(index), index.version)
+    index.add(_low_rank_corpus(n=40, seed=1).tolist())
+    assert not index.needs_refit(min_rows=50, growth=0.5)
+    index.add(_low_rank_corpus(n=20, seed=2).tolist())
+    assert index.needs_refit(min_rows=50, growth=0.5)
+
+
+def test_store_refits_in_background_and_searches_projected(fresh_store, monkeypatch):
+    monkeypatch.setattr(fresh_store, "PROJECTION_METHOD", "pca")
+    monkeypatch.setattr(fresh_store, "PROJECTION_DIM", 16)
+    monkeypatch.setattr(fresh_store, "PROJECTION_MIN_ROWS", 100)
+    corpus = _low_rank_corpus(n=400)
+    fresh_store.add_doc_chunks(
+        {"text": f"chunk {i}", "embedding": emb, "source": "user", "title": "T"}
+        for i, emb in enumerate(corpus.tolist())
+    )
+
+    assert asyncio.run(fresh_store.refit_projection())
+    assert fresh_store._default.index.projection.shape == (64, 16)
+    assert not asyncio.run(fresh_store.refit_projection())  # not due again until the corpus grows
+
+    results = fresh_store.search(corpus[42].tolist(), top_k=3)
+    assert results[0][1].text == "chunk 42"
+
+
+def test_centroids_follow_incremental_adds_and_deletes():
+    centroids = DocumentCentroids()
+    centroids.update(["a", "a", "b"], np.array([[1.0, 0.0], [0.0, 1.0], [0.0, 1.0]], dtype=np.float32))
+    assert centroids.top([1.0, 0.0], 1) == ["a"]
+
+    centroids.update(["a"], np.array([[1.0, 0.0]], dtype=np.float32), sign=-1)
+    assert centroids.top([1.0, 0.0], 2) == ["a", "b"]  # a and b now tie on [0, 1]
+
+    centroids.update(["b"], np.array([[0.0, 1.0]], dtype=np.float32), sign=-1)
+    assert centroids.top([0.0, 1.0], 2) == ["a"]  # b has no live chunks left
+
+    centroids.set_summary("b", [1.0, 0.0])
+    centroids.update(["b"], np.array([[0.0, 1.0]], dtype=np.float32))
+    assert centroids.top([1.0, 0.0], 1) == ["b"]  # routed by its summary
+    assert centroids.top([1.0, 0.0], 2, allowed=np.array([True, False])) == ["a"]
+
+
+def _topic_corpus(docs=40, chunks=5, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((docs, dim))
+    return topics[:, None, :] + 0.2 * rng.standard_normal((docs, chunks, dim))
+
+
+def test_store_coarse_search_scores_only_the_nearest_documents(fresh_store, monkeypatch):
+    monkeypatch.setattr(fresh_store, "COARSE_MIN_DOCS", 10)
+    monkeypatch.setattr(fresh_store, "COARSE_DOCS", 3)
+    corpus = _topic_corpus()
+    doc_ids = [uuid4() for _ in corpus]
+    fresh_store.add_doc_chunks(
+        {
+            "text": f"{d}/{c}",
+            "embedding": emb.tolist(),
+            "source": "wikipedia" if d % 2 else "user",
+            "title": f"Doc {d}",
+            "doc_id": doc_ids[d],
+        }
+        for d, doc in enumerate(corpus)
+        for c, emb in enumerate(doc)
+    )
+    scored = []
+    top_k_among = fresh_store._default.index.top_k_among
+    monkeypatch.setattr(
+        fresh_store._default.index, "top_k_among",
+        lambda q, rows, k: (scored.append(len(rows)), top_k_among(q, rows, k))[1],
+    )
+
+    results = fresh_store.search(corpus[7, 2].tolist(), top_k=2)
+    assert results[0][1].text == "7/2"
+    assert scored == [15]  # 3 documents x 5 chunks
+
+    filtered = fresh_store.search(corpus[7, 2].tolist(), top_k=5, sources=["user"])
+    assert filtered and {d.source for _, d in filtered} == {"user"}
+
+    fresh_store.delete_document(doc_ids[7])
+    assert all(d.doc_id != doc_ids[7] for _, d in fresh_store.search(corpus[7, 2].tolist(), top_k=5))
+    fresh_store.compact()
+    assert len(fresh_store._default.centroids) == len(corpus) - 1
+    assert fresh_store.search(corpus[8, 0].tolist(), top_k=1)[0][1].text == "8/0"
+
+
+def test_document_summary_is_persisted_and_dropped_on_replace(fresh_store):
+    doc_id = uuid4()
+    fresh_store.add_doc_chunks(
+        [{"text": "intro", "embedding": [1.0, 0.0], "source": "user", "title": "T", "doc_id": doc_id}]
+    )
+
+    assert fresh_store.set_document_summary(doc_id, "About axes.", [0.0, 1.0])
+    assert not fresh_store.set_document_summary(uuid4(), "Unknown.", [0.0, 1.0])
+    reloaded = importlib.reload(fresh_store)
+    assert [d["summary"] for d in reloaded.list_documents()] == ["About axes."]
+
+    reloaded.replace_document(
+        doc_id, [{"text": "intro v2", "embedding": [1.0, 1.0], "source": "user", "title": "T"}]
+    )
+    assert [d["summary"] for d in reloaded.list_documents()] == [None]
@@ -1,5 +1,11 @@
-import pytest
+import asyncio
+import json
 import math
+from uuid import uuid4
+
+import pytest
+
+from app import rag, sessions
 from app.rag import split_into_chunks, cosine_similarity
 
 
@@ -198,3 +204,298 @@ class TestCosineSimilarity:
         assert -1.0 <= result <= 1.0
         assert isinstance(result, float)
 
+
+class TestStoreTexts:
+    """Tests for the bulk store_texts ingestion path."""
+
+    def test_single_flush_for_many_documents(self, fresh_store, store_flushes, monkeypatch):
+        """Test that several documents are embedded in batches and flushed once."""
+        embed_calls = []
+
+        async def fake_get_embeddings(texts, priority=None):
+            embed_calls.append(len(texts))
+            return [[1.0, float(i)] for i in range(len(texts))]
+
+        monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+        monkeypatch.setattr(rag, "EMBED_BATCH_SIZE", 2)
+
+        documents = [
+            {"title": "A", "text": "a1\n" + "x" * 600 + "\na2", "source": "user"},
+            {"title": "B", "text": "b1", "source": "wikipedia"},
+        ]
+        ids = asyncio.run(rag.store_texts(documents))
+
+        assert [len(doc_ids) for doc_ids in ids] == [3, 1]
+        assert embed_calls == [2, 2]
+        assert len(store_flushes) == 1
+        assert [d.title for d in fresh_store.get_docs()] == ["A", "A", "A", "B"]
+
+
+class TestStorePages:
+    """Tests for the page-by-page upload path."""
+
+    def test_uncapped_document_is_embedded_in_batches_and_flushed_once(
+        self, fresh_store, store_flushes, monkeypatch
+    ):
+        """Test that an uncapped document never sends or holds more than one batch of chunks."""
+        embed_calls = []
+
+        async def fake_get_embeddings(texts, priority=None):
+            embed_calls.append(len(texts))
+            return [[1.0, float(i)] for i in range(len(texts))]
+
+        monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+        monkeypatch.setattr(rag, "EMBED_BATCH_SIZE", 2)
+        pages = (f"Page {n} " + "x" * 600 for n in range(5))
+
+        ids = asyncio.run(rag.store_pages("Book", pages, "user", max_chunks=0))
+
+        assert embed_calls == [2, 2, 1]
+        assert len(store_flushes) == 1
+        assert [c.id for c in fresh_store.get_docs()] == ids
+
+    def test_failed_batch_removes_the_partial_document(self, fresh_store, monkeypatch):
+        """Test that a failure after some batches were stored leaves no chunks behind."""
+        async def flaky_get_embeddings(texts, priority=None):
+            if fresh_store.get_docs():
+                raise rag.HTTPException(status_code=503, detail="busy")
+            return [[1.0, 0.0] for _ in texts]
+
+        monkeypatch.setattr(rag, "get_embeddings", flaky_get_embeddings)
+        monkeypatch.setattr(rag, "EMBED_BATCH_SIZE", 1)
+
+        with pytest.raises(rag.HTTPException):
+            asyncio.run(rag.store_pages("Book", ["a " * 400, "b " * 400], "user", max_chunks=0))
+
+        assert fresh_store.get_docs() == []
+        assert json.loads(fresh_store.DATA_PATH.read_text())["doc_chunks"] == []
+
+
+class TestUpdateDocument:
+    """Tests for update_document re-embedding only changed chunks."""
+
+    def test_only_changed_chunks_are_embedded(self, fresh_store, monkeypatch):
+        """Test that unchanged paragraphs reuse their stored embeddings."""
+        doc_id = uuid4()
+        embedded = []
+
+        async def fake_get_embeddings(texts, priority=None):
+            embedded.extend(texts)
+            return [[1.0, float(len(t))] for t in texts]
+
+        monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+
+        first = "A" * 400 + "\n" + "B" * 400
+        asyncio.run(rag.store_text("Notes", first, "user", doc_id=doc_id))
+        embedded.clear()
+
+        revised = "A" * 400 + "\n" + "C" * 400
+        chunk_ids, reembedded = asyncio.run(
+            rag.update_document(doc_id, "Notes", revised, "user")
+        )
+
+        assert reembedded == 1
+        assert embedded == ["C" * 400]
+        assert [c.text for c in fresh_store.get_document(doc_id)] == ["A" * 400, "C" * 400]
+        assert [c.id for c in fresh_store.get_document(doc_id)] == chunk_ids
+
+
+class TestAutoWikipedia:
+    """Tests for Wikipedia context fetched while answering a question."""
+
+    @pytest.mark.usefixtures("fresh_store")
+    def test_fetch_on_chat_path_is_not_bulk_priority(self, monkeypatch):
+        """Test that embeddings for auto-fetched articles skip the bulk ingest queue."""
+        monkeypatch.setattr(rag, "add_doc_chunks", lambda rows, collection=None: [])
+        monkeypatch.setattr(rag.wikipedia, "search", lambda question, results: ["Osmosis"])
+        monkeypatch.setattr(
+            rag.wikipedia,
+            "page",
+            lambda title, auto_suggest: type("Page", (), {"title": title, "content": "Water moves."}),
+        )
+        priorities = []
+
+        async def fake_get_embeddings(texts, priority=rag.Priority.BULK):
+            priorities.append(priority)
+            return [[1.0] for _ in texts]
+
+        monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+        asyncio.run(rag._ensure_wikipedia_context("What is osmosis?", max_new_articles=1))
+
+        assert priorities == [rag.Priority.QUERY]
+
+
+class TestDocumentSummaries:
+    """Tests for the optional per-document summaries used by coarse search."""
+
+    def test_summary_is_generated_at_bulk_priority_and_stored(self, fresh_store, monkeypatch):
+        """Test that a summary and its embedding are stored without touching the chat queue."""
+        doc_id = uuid4()
+        fresh_store.add_doc_chunks(
+            [{"text": "Cells divide.", "embedding": [1.0, 0.0], "source": "user",
+              "title": "Biology", "doc_id": doc_id}]
+        )
+        priorities = []
+
+        async def fake_post_chat(payload, priority=rag.Priority.INTERACTIVE):
+            priorities.append(priority)
+            assert "Cells divide." in payload["messages"][-1]["content"]
+            return "Covers cell division."
+
+        async def fake_get_embeddings(texts, priority=rag.Priority.BULK):
+            priorities.append(priority)
+            return [[0.0, 1.0] for _ in texts]
+
+        monkeypatch.setattr(rag, "_post_chat", fake_post_chat)
+        monkeypatch.setattr(rag, "get_embeddings", fake_get_embeddings)
+
+        assert asyncio.run(rag.summarize_document(doc_id)) == "Covers cell division."
+        assert priorities == [rag.Priority.BULK, rag.Priority.BULK]
+        assert fresh_store._default.doc_summaries[doc_id]["embedding"] == [0.0, 1.0]
+        assert asyncio.run(rag.summarize_document(uuid4())) is None
+
+
+class TestAdaptiveContext:
+    """Tests for score-based context trimming and the no-context fast path."""
+
+    def _chunk(self, title):
+        return rag.DocChunk(id=uuid4(), text=title, embedding=[1.0], source="user", title=title)
+
+    def test_min_score_and_gap_trim_results(self):
+        """Test that both cutoffs drop weak chunks and keep the best-first order."""
+        scored = [(0.9, self._chunk("A")), (0.85, self._chunk("B")), (0.5, self._chunk("C")), (0.1, self._chunk("D"))]
+
+        assert [c.title for _, c in rag.select_context(scored, min_score=0.3, max_score_gap=0)] == ["A", "B", "C"]
+        assert [c.title for _, c in rag.select_context(scored, min_score=0.0, max_score_gap=0.1)] == ["A", "B"]
+        assert rag.select_context(scored, min_score=0.95, max_score_gap=0) == []
+
+    def test_no_relevant_context_skips_the_llm(self, fresh_store, monkeypatch):
+        """Test that nothing above the threshold returns the canned answer without a chat call."""
+        fresh_store.add_doc_chunk(text="Atoms have protons.", embedding=[0.0, 1.0], source="user", title="Chem")
+        chat_calls = []
+
+        async def fake_get_embedding(text):
+            return [1.0, 0.05]
+
+        async def fake_chat(prompt, history=None):
+            chat_calls.append(prompt)
+            return "answer"
+
+        monkeypatch.setattr(rag, "get_embedding", fake_get_embedding)
+        monkeypatch.setattr(rag, "call_mistral_chat", fake_chat)
+        monkeypatch.setattr(rag, "retrieval_paths", rag.Counter())
+
+        answer, context = asyncio.run(rag.rag_answer("What is mitosis?", min_score=0.5))
+        assert (answer, context, chat_calls) == (rag.NO_CONTEXT_ANSWER, [], [])
+
+        asyncio.run(rag.rag_answer("What is mitosis?", min_score=0.5, answer_without_context=True))
+        asyncio.run(rag.rag_answer("What is mitosis?", min_score=0.0))
+        assert len(chat_calls) == 2
+        assert rag.retrieval_paths == {"no_context": 1, "trimmed": 1, "full": 1}
+
+
+class TestSessionAnswer:
+    """Tests for conversation sessions with incremental retrieval."""
+
+    def test_follow_up_reuses_prefix_and_sends_only_new_chunks(self, fresh_store, monkeypatch):
+        """Test that a follow-up replays the first turn verbatim and adds only unseen chunks."""
+        fresh_store.add_doc_chunks(
+            [
+                {"text": "Cells divide by mitosis.", "embedding": [1.0, 0.0, 0.0], "source": "user", "title": "Bio"},
+                {"text": "Meiosis makes gametes.", "embedding": [0.8, 0.6, 0.0], "source": "user", "title": "Bio"},
+                {"text": "Atoms have protons.", "embedding": [0.0, 0.0, 1.0], "source": "user", "title": "Chem"},
+            ]
+        )
+        query_vectors = {"What is mitosis?": [1.0, 0.1, 0.0], "And atoms?": [0.0, 0.1, 1.0]}
+        embed_calls = []
+        chat_calls = []
+
+        async def fake_get_embedding(text):
+            embed_calls.append(text)
+            return query_vectors[text]
+
+        async def fake_chat(prompt, history=None):
+            chat_calls.append((prompt, list(history or [])))
+            return f"answer {len(chat_calls)}"
+
+        monkeypatch.setattr(rag, "get_embedding", fake_get_embedding)
+        monkeypatch.setattr(rag, "call_mistral_chat", fake_chat)
+        session = sessions.Session(id=uuid4(), collection=None, sources=None)
+
+        asyncio.run(rag.rag_answer("What is mitosis?", top_k=2, session=session))
+        asyncio.run(rag.rag_answer("And atoms?", top_k=2, session=session))
+        asyncio.run(rag.rag_answer("What is mitosis?", top_k=2, session=session))
+
+        first_prompt, first_history = chat_calls[0]
+        second_prompt, second_history = chat_calls[1]
+        third_prompt, third_history = chat_calls[2]
+        assert first_history == []
+        assert "Cells divide" in first_prompt and "Meiosis" in first_prompt
+        assert second_history == [
+            {"role": "user", "content": first_prompt},
+            {"role": "assistant", "content": "answer 1"},
+        ]
+        # Only the unseen chunk is added; mitosis was already sent in turn one.
+        assert "Atoms have protons" in second_prompt and "Cells divide" not in second_prompt
+        assert third_history[:2] == second_history and "Context:" not in third_prompt
+        assert embed_calls == ["What is mitosis?", "And atoms?"]
+        assert session.turns == 3
+
+    def _seed(self, store, monkeypatch):
+        bio, chem = uuid4(), uuid4()
+        store.add_doc_chunks(
+            [
+                {"text": "Cells divide by mitosis.", "embedding": [1.0, 0.0], "source": "user", "title": "Bio", "doc_id": bio},
+                {"text": "Atoms have protons.", "embedding": [0.0, 1.0], "source": "user", "title": "Chem", "doc_id": chem},
+            ]
+        )
+
+        async def fake_get_embedding(text):
+            return [1.0, 0.1] if "mitosis" in text else [0.1, 1.0]
+
+        monkeypatch.setattr(rag, "get_embedding", fake_get_embedding)
+        return bio, chem
+
+    def test_failed_chat_call_leaves_session_unchanged(self, fresh_store, monkeypatch):
+        """Test that a turn whose LLM call fails records no chunks, embedding or history."""
+        self._seed(fresh_store, monkeypatch)
+        chat_calls = []
+
+        async def flaky_chat(prompt, history=None):
+            chat_calls.append(prompt)
+            if len(chat_calls) == 1:
+                raise rag.HTTPException(status_code=503, detail="busy")
+            return "answer"
+
+        monkeypatch.setattr(rag, "call_mistral_chat", flaky_chat)
+        session = sessions.Session(id=uuid4(), collection=None, sources=None)
+
+        with pytest.raises(rag.HTTPException):
+            asyncio.run(rag.rag_answer("What is mitosis?", top_k=1, session=session))
+        assert session.chunks == [] and session.messages == [] and session.query_embeddings == {}
+
+        asyncio.run(rag.rag_answer("What is mitosis?", top_k=1, session=session))
+        # The retry must still carry the context the failed turn never delivered.
+        assert "Cells divide" in chat_calls[1]
+        assert session.turns == 1
+
+    def test_deleted_chunks_are_not_replayed(self, fresh_store, monkeypatch):
+        """Test that a chunk deleted mid-conversation drops out of the session and its history."""
+        bio, _ = self._seed(fresh_store, monkeypatch)
+        chat_calls = []
+
+        async def fake_chat(prompt, history=None):
+            chat_calls.append((prompt, list(history or [])))
+            return "answer"
+
+        monkeypatch.setattr(rag, "call_mistral_chat", fake_chat)
+        session = sessions.Session(id=uuid4(), collection=None, sources=None)
+
+        asyncio.run(rag.rag_answer("What is mitosis?", top_k=1, session=session))
+        fresh_store.delete_document(bio)
+        asyncio.run(rag.rag_answer("And atoms?", top_k=1, session=session))
+
+        prompt, history = chat_calls[-1]
+        assert history == []
+        assert "Cells divide" not in prompt and "Atoms have protons" in prompt
+        assert [c.title for c in session.chunks] == ["Chem"]
@@ -0,0 +1,189 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app import scheduler
+from app.scheduler import Priority, TokenBucket, UpstreamScheduler
+
+
+def _unlimited(**kwargs):
+    """Scheduler with no rate limit, so only priority and concurrency matter."""
+    kwargs.setdefault("rate", 0)
+    kwargs.setdefault("burst", 1)
+    return UpstreamScheduler(**kwargs)
+
+
+async def _hold(gate):
+    await gate.wait()
+
+
+def test_waiters_are_granted_in_priority_order():
+    sched = _unlimited(max_concurrency=1, bulk_concurrency=1)
+    order = []
+
+    async def record(priority):
+        order.append(priority)
+
+    async def main():
+        gate = asyncio.Event()
+        holder = asyncio.ensure_future(sched.run(Priority.INTERACTIVE, lambda: _hold(gate)))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.ensure_future(sched.run(p, lambda p=p: record(p)))
+            for p in (Priority.BULK, Priority.QUERY, Priority.INTERACTIVE)
+        ]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(holder, *waiters)
+
+    asyncio.run(main())
+    assert order == [Priority.INTERACTIVE, Priority.QUERY, Priority.BULK]
+
+
+def test_bulk_never_exceeds_its_concurrency_cap():
+    sched = _unlimited(max_concurrency=4, bulk_concurrency=2)
+    peak = 0
+    running = 0
+
+    async def job():
+        nonlocal peak, running
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.005)
+        running -= 1
+
+    async def main():
+        await asyncio.gather(*(sched.run(Priority.BULK, job) for _ in range(10)))
+
+    asyncio.run(main())
+    assert peak == 2
+
+
+def test_interactive_is_admitted_while_bulk_holds_its_slots():
+    sched = _unlimited(max_concurrency=3, bulk_concurrency=2)
+
+    async def main():
+        gate = asyncio.Event()
+        bulk = [asyncio.ensure_future(sched.run(Priority.BULK, lambda: _hold(gate))) for _ in range(6)]
+        await asyncio.sleep(0)
+        answer = await asyncio.wait_for(sched.run(Priority.INTERACTIVE, _answer), timeout=1)
+        gate.set()
+        await asyncio.gather(*bulk)
+        return answer
+
+    async def _answer():
+        return "ok"
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_token_bucket_paces_admissions():
+    sched = UpstreamScheduler(rate=50, burst=1, max_concurrency=8)
+    admitted = []
+
+    async def job():
+        admitted.append(time.monotonic())
+
+    async def main():
+        await asyncio.gather(*(sched.run(Priority.QUERY, job) for _ in range(6)))
+
+    asyncio.run(main())
+    # One token up front, then one every 20 ms.
+    assert admitted[-1] - admitted[0] >= 5 * 0.02 * 0.8
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=1000, burst=3)
+    assert [bucket.try_take() for _ in range(4)] == [True, True, True, False]
+    time.sleep(0.01)
+    assert bucket.tokens <= 3 and bucket.try_take()
+
+
+def test_full_queue_sheds_immediately_with_503():
+    sched = _unlimited(max_concurrency=1, queue_limits={p: 1 for p in Priority})
+
+    async def main():
+        gate = asyncio.Event()
+        holder = asyncio.ensure_future(sched.run(Priority.QUERY, lambda: _hold(gate)))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(sched.run(Priority.QUERY, lambda: _hold(gate)))
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        with pytest.raises(HTTPException) as exc:
+            await sched.run(Priority.QUERY, lambda: _hold(gate))
+        elapsed = time.monotonic() - started
+        gate.set()
+        await asyncio.gather(holder, queued)
+        return exc.value.status_code, elapsed
+
+    status, elapsed = asyncio.run(main())
+    assert status == 503
+    assert elapsed < 0.05
+    assert sched.metrics()["classes"]["query"]["shed"] == 1
+
+
+def test_cancelled_callers_release_their_slot():
+    sched = _unlimited(max_concurrency=1)
+
+    async def main():
+        running = asyncio.ensure_future(sched.run(Priority.BULK, lambda: _hold(asyncio.Event())))
+        waiting = asyncio.ensure_future(sched.run(Priority.BULK, lambda: _hold(asyncio.Event())))
+        await asyncio.sleep(0)
+        running.cancel()
+        waiting.cancel()
+        await asyncio.gather(running, waiting, return_exceptions=True)
+        assert sched._active == 0
+        return await asyncio.wait_for(sched.run(Priority.INTERACTIVE, _done), timeout=1)
+
+    async def _done():
+        return "done"
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_interactive_wait_stays_low_during_bulk_ingest():
+    sched = UpstreamScheduler(rate=200, burst=2, max_concurrency=4, bulk_concurrency=2)
+
+    async def upstream_call():
+        await asyncio.sleep(0.01)
+
+    async def main():
+        bulk = [asyncio.ensure_future(sched.run(Priority.BULK, upstream_call)) for _ in range(100)]
+        for _ in range(10):
+            await sched.run(Priority.INTERACTIVE, upstream_call)
+            await asyncio.sleep(0.005)
+        await asyncio.gather(*bulk)
+
+    asyncio.run(main())
+    classes = sched.metrics()["classes"]
+    # 100 bulk calls need ~0.5 s of tokens; chats never wait behind that backlog.
+    assert classes["interactive"]["granted"] == 10
+    assert classes["interactive"]["wait_ms_p99"] < 50
+    assert classes["bulk"]["wait_ms_max"] > classes["interactive"]["wait_ms_p99"]
+
+
+def test_scheduler_recovers_after_its_event_loop_closes():
+    sched = UpstreamScheduler(rate=1, burst=1)
+
+    async def job():
+        return "ok"
+
+    async def leave_waiter_behind():
+        await sched.run(Priority.BULK, job)
+        # No token left: this caller is parked on a refill timer when the loop ends.
+        pending = asyncio.ensure_future(sched.run(Priority.BULK, job))
+        await asyncio.sleep(0)
+        pending.cancel()
+
+    asyncio.run(leave_waiter_behind())
+    sched.bucket = TokenBucket(rate=0, burst=1)
+    assert asyncio.run(asyncio.wait_for(sched.run(Priority.BULK, job), timeout=1)) == "ok"
+
+
+def test_share_quota_splits_rate_between_processes(monkeypatch):
+    monkeypatch.setattr(scheduler, "upstream", UpstreamScheduler())
+    scheduler.share_quota(4)
+    assert scheduler.upstream.bucket.rate == pytest.approx(scheduler.UPSTREAM_RPS / 4)
+    assert scheduler.upstream.bucket.burst >= 1
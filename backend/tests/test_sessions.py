@@ -0,0 +1,41 @@
+from uuid import uuid4
+
+from app import sessions
+
+
+def test_sessions_are_evicted_least_recently_used(monkeypatch):
+    monkeypatch.setattr(sessions, "_sessions", type(sessions._sessions)())
+    monkeypatch.setattr(sessions, "MAX_SESSIONS", 2)
+    first, second, third = uuid4(), uuid4(), uuid4()
+
+    sessions.get_session(first)
+    sessions.get_session(second)
+    sessions.get_session(first)
+    sessions.get_session(third)
+
+    assert list(sessions._sessions) == [first, third]
+
+
+def test_idle_sessions_expire(monkeypatch):
+    monkeypatch.setattr(sessions, "_sessions", type(sessions._sessions)())
+    clock = [1000.0]
+    monkeypatch.setattr(sessions.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(sessions, "SESSION_IDLE_SECONDS", 60)
+
+    session = sessions.get_session(uuid4())
+    session.record_turn("q", "a")
+    clock[0] += 61
+
+    assert sessions.session_count() == 0
+    assert sessions.get_session(session.id).messages == []
+
+
+def test_session_resets_when_filters_change(monkeypatch):
+    monkeypatch.setattr(sessions, "_sessions", type(sessions._sessions)())
+    session_id = uuid4()
+
+    session = sessions.get_session(session_id, "bio", ["user"])
+    session.record_turn("q", "a")
+
+    assert sessions.get_session(session_id, "bio", ["user"]) is session
+    assert sessions.get_session(session_id, "chem", ["user"]).messages == []
@@ -1,26 +1,14 @@
 import importlib
 import json
-import sys
-from pathlib import Path
-from typing import Tuple
+from uuid import uuid4
 
 import pytest
 
 
-def _fresh_store(tmp_path: Path, monkeypatch) -> Tuple[object, Path]:
-    store_file = tmp_path / "store.json"
-    monkeypatch.setenv("STUDYBUDDY_STORE_PATH", str(store_file))
-    if "app.store" in sys.modules:
-        store_module = importlib.reload(sys.modules["app.store"])
-    else:
-        store_module = importlib.import_module("app.store")
-    return store_module, store_file
-
+def test_add_doc_chunk_persists_to_disk(fresh_store):
+    store_file = fresh_store.DATA_PATH
 
-def test_add_doc_chunk_persists_to_disk(tmp_path, monkeypatch):
-    store, store_file = _fresh_store(tmp_path, monkeypatch)
-
-    chunk = store.add_doc_chunk(
+    chunk = fresh_store.add_doc_chunk(
         text="Example text",
         embedding=[0.1, 0.2, 0.3],
         source="user",
@@ -35,16 +23,399 @@ def test_add_doc_chunk_persists_to_disk(tmp_path, monkeypatch):
     assert data["doc_chunks"][0]["source"] == "user"
 
 
-def test_question_count_survives_reload(tmp_path, monkeypatch):
-    store, store_file = _fresh_store(tmp_path, monkeypatch)
+def test_interrupted_save_keeps_the_previous_store_file(fresh_store, monkeypatch):
+    fresh_store.add_doc_chunk(text="Existing", embedding=[1.0, 0.0], source="user", title="A")
+
+    def interrupted_dump(payload, fp, **kwargs):
+        fp.write('{"doc_chunks": [')
+        raise KeyboardInterrupt
+
+    dump = fresh_store.json.dump
+    monkeypatch.setattr(fresh_store.json, "dump", interrupted_dump)
+    with pytest.raises(KeyboardInterrupt):
+        fresh_store.add_doc_chunk(text="New", embedding=[0.0, 1.0], source="user", title="B")
+    monkeypatch.setattr(fresh_store.json, "dump", dump)
+
+    reloaded = importlib.reload(fresh_store)
+    assert [d.text for d in reloaded.get_docs()] == ["Existing"]
+
+
+def test_question_count_survives_reload(fresh_store):
+    store_file = fresh_store.DATA_PATH
     assert not store_file.exists()
 
-    store.increment_questions_count()
-    store.increment_questions_count()
+    fresh_store.increment_questions_count()
+    fresh_store.increment_questions_count()
 
     # Reload module to force disk read
-    reloaded_store, _ = _fresh_store(tmp_path, monkeypatch)
+    reloaded_store = importlib.reload(fresh_store)
     stats = reloaded_store.get_stats()
 
     assert stats["total_questions"] == 2
 
+
+def test_add_doc_chunks_flushes_once_per_batch(fresh_store, store_flushes):
+    store_file = fresh_store.DATA_PATH
+
+    created = fresh_store.add_doc_chunks(
+        {"text": f"Chunk {i}", "embedding": [1.0, float(i)], "source": "user", "title": "Bulk"}
+        for i in range(10)
+    )
+
+    assert len(store_flushes) == 1
+    assert len({chunk.id for chunk in created}) == 10
+    data = json.loads(store_file.read_text(encoding="utf-8"))
+    assert [c["id"] for c in data["doc_chunks"]] == [str(chunk.id) for chunk in created]
+
+
+def test_add_doc_chunks_is_atomic(fresh_store, store_flushes):
+    fresh_store.add_doc_chunk(text="Existing", embedding=[1.0, 0.0], source="user", title="A")
+    store_flushes.clear()
+
+    with pytest.raises(ValueError):
+        fresh_store.add_doc_chunks(
+            [
+                {"text": "Good", "embedding": [0.0, 1.0], "source": "user", "title": "B"},
+                {"text": "Bad", "embedding": [1.0, 2.0, 3.0], "source": "user", "title": "B"},
+            ]
+        )
+
+    assert store_flushes == []
+    assert [d.text for d in fresh_store.get_docs()] == ["Existing"]
+    assert [d.text for _, d in fresh_store.search([1.0, 0.0], top_k=5)] == ["Existing"]
+
+
+def test_search_ranks_and_filters_by_source(fresh_store):
+    fresh_store.add_doc_chunks(
+        [
+            {"text": "x-axis", "embedding": [1.0, 0.0], "source": "user", "title": "A"},
+            {"text": "diagonal", "embedding": [1.0, 1.0], "source": "wikipedia", "title": "B"},
+            {"text": "y-axis", "embedding": [0.0, 1.0], "source": "user", "title": "C"},
+        ]
+    )
+
+    ranked = fresh_store.search([1.0, 0.1], top_k=2)
+    assert [d.text for _, d in ranked] == ["x-axis", "diagonal"]
+    assert ranked[0][0] > ranked[1][0]
+
+    user_only = fresh_store.search([1.0, 1.0], top_k=3, sources=["user"])
+    assert {d.text for _, d in user_only} == {"x-axis", "y-axis"}
+
+
+def _add_document(store, doc_id, texts, source="user", title="Doc"):
+    return store.add_doc_chunks(
+        {"text": text, "embedding": [1.0, float(i)], "source": source, "title": title, "doc_id": doc_id}
+        for i, text in enumerate(texts)
+    )
+
+
+def test_delete_document_tombstones_without_rebuild(fresh_store):
+    store_file = fresh_store.DATA_PATH
+    keep, drop = uuid4(), uuid4()
+    _add_document(fresh_store, keep, ["keep 1", "keep 2"])
+    _add_document(fresh_store, drop, ["drop 1", "drop 2"], title="Old syllabus")
+    matrix_before = fresh_store._default.index._matrix
+
+    assert fresh_store.delete_document(drop) == 2
+    assert fresh_store.delete_document(drop) == 0
+
+    # Rows are masked, not rebuilt
+    assert fresh_store._default.index._matrix is matrix_before
+    assert len(fresh_store._default.index) == 4 and fresh_store._default.index.dead == 2
+    assert {d.text for _, d in fresh_store.search([1.0, 0.5], top_k=10)} == {"keep 1", "keep 2"}
+    assert [d["doc_id"] for d in fresh_store.list_documents()] == [keep]
+    data = json.loads(store_file.read_text(encoding="utf-8"))
+    assert [c["text"] for c in data["doc_chunks"]] == ["keep 1", "keep 2"]
+
+
+def test_maybe_compact_reclaims_tombstones(fresh_store, monkeypatch):
+    monkeypatch.setattr(fresh_store, "COMPACT_RATIO", 0.5)
+    docs = [uuid4() for _ in range(4)]
+    for doc_id in docs:
+        _add_document(fresh_store, doc_id, [f"{doc_id} a"])
+
+    fresh_store.delete_document(docs[0])
+    assert fresh_store.maybe_compact() == 0
+
+    fresh_store.delete_document(docs[1])
+    assert fresh_store.maybe_compact() == 2
+    assert len(fresh_store._default.index) == 2 and fresh_store._default.index.dead == 0
+    assert [d.doc_id for d in fresh_store.get_docs()] == docs[2:]
+    assert [d.doc_id for _, d in fresh_store.search([1.0, 0.0], top_k=5)] == docs[2:]
+    assert fresh_store.delete_document(docs[3]) == 1
+
+
+def test_replace_document_keeps_unchanged_chunks(fresh_store):
+    doc_id = uuid4()
+    original = _add_document(fresh_store, doc_id, ["intro", "chapter 1", "chapter 2"])
+
+    updated = fresh_store.replace_document(
+        doc_id,
+        [
+            {"text": "intro", "embedding": [1.0, 0.0], "source": "user", "title": "Doc v2"},
+            {"text": "chapter 1 revised", "embedding": [0.0, 1.0], "source": "user", "title": "Doc v2"},
+        ],
+    )
+
+    assert updated[0].id == original[0].id
+    assert updated[1].id not in {c.id for c in original}
+    assert [c.text for c in fresh_store.get_document(doc_id)] == ["intro", "chapter 1 revised"]
+    assert {c.title for c in fresh_store.get_document(doc_id)} == {"Doc v2"}
+    assert fresh_store._default.index.dead == 2
+
+
+def test_replace_document_relabels_the_source_filter(fresh_store):
+    doc_id = uuid4()
+    _add_document(fresh_store, doc_id, ["intro"])
+
+    fresh_store.replace_document(
+        doc_id, [{"text": "intro", "embedding": [1.0, 0.0], "source": "wikipedia", "title": "Doc"}]
+    )
+
+    assert fresh_store.search([1.0, 0.0], top_k=1, sources=["user"]) == []
+    assert [d.text for _, d in fresh_store.search([1.0, 0.0], top_k=1, sources=["wikipedia"])] == ["intro"]
+
+
+def test_replace_document_follows_the_revised_order(fresh_store):
+    doc_id = uuid4()
+    original = _add_document(fresh_store, doc_id, ["intro", "ch1", "ch2"])
+    embeddings = {c.text: c.embedding for c in original}
+
+    updated = fresh_store.replace_document(
+        doc_id,
+        [
+            {"text": text, "embedding": [0.0, 1.0], "source": "user", "title": title}
+            for text, title in [("preface", "Doc v2"), ("intro", "Doc v2"), ("ch2", "Doc v2")]
+        ],
+    )
+
+    assert [c.text for c in updated] == ["preface", "intro", "ch2"]
+    assert [c.id for c in updated[1:]] == [original[0].id, original[2].id]
+    assert [c.embedding for c in updated[1:]] == [embeddings["intro"], embeddings["ch2"]]
+    assert [c.text for c in fresh_store.get_document(doc_id)] == ["preface", "intro", "ch2"]
+    assert fresh_store.list_documents()[0]["title"] == "Doc v2"
+    reloaded = importlib.reload(fresh_store)
+    assert [c.text for c in reloaded.get_document(doc_id)] == ["preface", "intro", "ch2"]
+
+
+def test_legacy_chunks_are_grouped_into_documents(fresh_store, tmp_path):
+    store_file = tmp_path / "store.json"
+    store_file.write_text(
+        json.dumps(
+            {
+                "doc_chunks": [
+                    {"id": str(uuid4()), "text": t, "embedding": [1.0, 0.0], "source": "user", "title": title}
+                    for t, title in [("a", "Notes"), ("b", "Notes"), ("c", "Other")]
+                ]
+            }
+        ),
+        encoding="utf-8",
+    )
+    store = importlib.reload(fresh_store)
+
+    documents = {d["title"]: d for d in store.list_documents()}
+    assert documents["Notes"]["chunks"] == 2
+    assert store.delete_document(documents["Notes"]["doc_id"]) == 2
+    assert [d.text for d in store.get_docs()] == ["c"]
+
+
+def test_mixed_dimension_chunks_are_kept_on_disk(fresh_store, tmp_path, caplog):
+    old_doc = uuid4()
+    (tmp_path / "store.json").write_text(json.dumps({"doc_chunks": [
+        {"id": str(uuid4()), "text": "a", "embedding": [1.0, 0.0], "source": "user", "title": "A"},
+        {"id": str(uuid4()), "text": "b", "embedding": [0.0, 1.0], "source": "user", "title": "B"},
+        {"id": str(uuid4()), "text": "old", "embedding": [1.0, 0.0, 0.0], "source": "user",
+         "title": "Old", "doc_id": str(old_doc)},
+    ]}))
+
+    store = importlib.reload(fresh_store)
+    assert "1 chunk(s) have an embedding dimension other than 2" in caplog.text
+    assert {d.text for _, d in store.search([1.0, 0.0], top_k=5)} == {"a", "b"}
+
+    store.add_doc_chunk(text="c", embedding=[1.0, 1.0], source="user", title="C")
+    stored = json.loads((tmp_path / "store.json").read_text())["doc_chunks"]
+    assert [c["text"] for c in stored] == ["a", "b", "c", "old"]
+
+    assert store.delete_document(old_doc) == 1
+    stored = json.loads((tmp_path / "store.json").read_text())["doc_chunks"]
+    assert [c["text"] for c in stored] == ["a", "b", "c"]
+
+
+def test_collections_are_isolated_and_persisted_separately(fresh_store, tmp_path):
+    store_file = fresh_store.DATA_PATH
+    fresh_store.add_doc_chunk(text="shared", embedding=[1.0, 0.0], source="user", title="Default")
+    fresh_store.add_doc_chunk(
+        text="alice notes", embedding=[1.0, 0.0], source="user", title="A", collection="alice"
+    )
+
+    assert [d.text for _, d in fresh_store.search([1.0, 0.0], top_k=5, collection="alice")] == ["alice notes"]
+    assert [d.text for _, d in fresh_store.search([1.0, 0.0], top_k=5)] == ["shared"]
+    assert [c["text"] for c in json.loads(store_file.read_text())["doc_chunks"]] == ["shared"]
+    assert (tmp_path / "collections" / "alice.json").exists()
+
+    reloaded = importlib.reload(fresh_store)
+    assert "alice" not in reloaded._collections
+    assert [d.text for d in reloaded.get_docs(collection="alice")] == ["alice notes"]
+    assert "alice" in reloaded._collections
+
+
+def test_collections_are_evicted_lru_within_budget(fresh_store, monkeypatch):
+    monkeypatch.setattr(fresh_store, "COLLECTION_MEMORY_BUDGET", 4)
+    for name in ("c1", "c2", "c3"):
+        fresh_store.add_doc_chunks(
+            (
+                {"text": f"{name} {i}", "embedding": [1.0, float(i)], "source": "user", "title": name}
+                for i in range(2)
+            ),
+            collection=name,
+        )
+
+    assert list(fresh_store._collections) == ["c2", "c3"]
+
+    # Touching c2 makes c3 the eviction candidate when c1 is reloaded.
+    fresh_store.search([1.0, 0.0], top_k=1, collection="c2")
+    assert len(fresh_store.get_docs(collection="c1")) == 2
+    assert list(fresh_store._collections) == ["c2", "c1"]
+
+
+def test_stats_list_collections_without_loading_them(fresh_store):
+    fresh_store.add_doc_chunk(text="a", embedding=[1.0], source="user", title="A", collection="bio")
+    fresh_store.increment_questions_count("bio")
+    fresh_store.increment_questions_count()
+
+    reloaded = importlib.reload(fresh_store)
+    collections = {c["name"]: c for c in reloaded.get_stats()["collections"]}
+
+    assert collections["bio"] == {
+        "name": "bio", "documents": 1, "chunks": 1, "questions": 1, "loaded": False,
+    }
+    assert collections["default"]["questions"] == 1
+    assert "bio" not in reloaded._collections
+
+
+def test_collection_summary_counters_follow_every_change(fresh_store, monkeypatch):
+    a, b = uuid4(), uuid4()
+    _add_document(fresh_store, a, ["a1", "a2"])
+    _add_document(fresh_store, b, ["b1"])
+    fresh_store.replace_document(
+        a, [{"text": "a0", "embedding": [1.0, 0.0], "source": "user", "title": "Doc"}]
+    )
+    fresh_store.delete_document(b)
+    assert fresh_store._default.summary() == {"documents": 1, "chunks": 1}
+
+    monkeypatch.setattr(fresh_store, "_save_state", lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        _add_document(fresh_store, b, ["b2", "b3"])
+    fresh_store.compact()
+    assert fresh_store._default.summary() == {"documents": 1, "chunks": 1}
+
+    # The counters are never read by scanning rows.
+    monkeypatch.setattr(fresh_store.Collection, "live_rows", lambda self: 1 / 0)
+    assert fresh_store.get_stats()["collections"][0]["chunks"] == 1
+
+
+def test_invalid_collection_name_is_rejected(fresh_store):
+    with pytest.raises(ValueError):
+        fresh_store.get_docs(collection="../escape")
+
+
+def test_reads_and_deletes_do_not_create_unknown_collections(fresh_store, tmp_path):
+    assert fresh_store.get_docs(collection="bilogy") == []
+    assert fresh_store.search([1.0], top_k=3, collection="bilogy") == []
+    assert fresh_store.list_documents("bilogy") == []
+    assert fresh_store.delete_document(uuid4(), "bilogy") == 0
+    fresh_store.increment_questions_count("bilogy")
+
+    stats = fresh_store.get_stats()
+    assert stats["total_questions"] == 1
+    assert [c["name"] for c in stats["collections"]] == ["default"]
+    assert "bilogy" not in fresh_store._collection_questions
+    assert not (tmp_path / "collections" / "bilogy.json").exists()
+
+
+def test_feedback_goes_to_its_own_log_and_counters(fresh_store, tmp_path):
+    store_file = fresh_store.DATA_PATH
+    fresh_store.add_feedback("q1", "a1", 1)
+    fresh_store.add_feedback("q2", "a2", -1, "wrong")
+    fresh_store.add_feedback("q3", "a3", 1)
+
+    log = [json.loads(line) for line in (tmp_path / "feedback.jsonl").read_text().splitlines()]
+    assert [entry["question"] for entry in log] == ["q1", "q2", "q3"]
+    assert not store_file.exists()
+
+    reloaded = importlib.reload(fresh_store)
+    stats = reloaded.get_stats()
+    assert (stats["total_feedback"], stats["positive_feedback"], stats["negative_feedback"]) == (3, 2, 1)
+
+
+def test_feedback_log_is_replayed_when_the_analytics_snapshot_is_unreadable(fresh_store, tmp_path):
+    for rating in (1, -1, 1):
+        fresh_store.add_feedback("q", "a", rating)
+    (tmp_path / "analytics.json").write_text('{"questions_count": ')
+
+    stats = importlib.reload(fresh_store).get_stats()
+    assert (stats["total_feedback"], stats["positive_feedback"], stats["negative_feedback"]) == (3, 2, 1)
+
+
+def test_legacy_feedback_is_moved_out_of_the_store_file(fresh_store, tmp_path):
+    store_file = tmp_path / "store.json"
+    store_file.write_text(json.dumps({
+        "doc_chunks": [],
+        "questions_count": 7,
+        "feedback": [{"question": "q", "answer": "a", "rating": -1, "comment": None}],
+    }))
+
+    store = importlib.reload(fresh_store)
+
+    stats = store.get_stats()
+    assert (stats["total_questions"], stats["negative_feedback"]) == (7, 1)
+    assert len((tmp_path / "feedback.jsonl").read_text().splitlines()) == 1
+
+
+def test_analytics_buckets_and_top_cited_documents(fresh_store, monkeypatch):
+    monkeypatch.setattr(fresh_store, "TOP_CITED", 2)
+    clock = iter([0, 10, 3600, 3610, 7200, 7201, 7202])
+    monkeypatch.setattr(fresh_store.time, "time", lambda: next(clock))
+    a, b, c = (
+        fresh_store.add_doc_chunk(text=t, embedding=[1.0], source="user", title=t) for t in ("A", "B", "C")
+    )
+
+    fresh_store.increment_questions_count()  # t=0
+    fresh_store.add_feedback("q", "a", 1)  # t=10
+    fresh_store.increment_questions_count()  # t=3600
+    fresh_store.add_feedback("q", "a", -1)  # t=3610
+    for cited in ([a, b], [c], [c, c]):
+        fresh_store.increment_questions_count(cited=cited)  # t=7200..7202
+
+    analytics = fresh_store.get_analytics()
+    assert [(bucket["start"], bucket["questions"], bucket["positive"], bucket["negative"])
+            for bucket in analytics["buckets"]] == [(0, 1, 1, 0), (3600, 1, 0, 1), (7200, 3, 0, 0)]
+    assert [(doc["title"], doc["citations"]) for doc in analytics["top_documents"]] == [("C", 2), ("A", 1)]
+
+    # Replayed from the logs on restart, feedback interleaved by time.
+    replayed = importlib.reload(fresh_store).get_analytics()
+    assert replayed["buckets"] == analytics["buckets"]
+    assert replayed["top_documents"][:2] == analytics["top_documents"]
+
+
+def test_analytics_appends_one_line_per_event_and_snapshots_periodically(fresh_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(fresh_store, "ANALYTICS_SNAPSHOT_EVERY", 3)
+    doc = fresh_store.add_doc_chunk(text="Notes", embedding=[1.0], source="user", title="Notes")
+    log = tmp_path / "analytics.jsonl"
+
+    fresh_store.increment_questions_count(cited=[doc])
+    fresh_store.add_feedback("q", "a", 1)
+    assert len(log.read_text().splitlines()) == 1
+    assert not (tmp_path / "analytics.json").exists()
+
+    fresh_store.increment_questions_count(cited=[doc])
+    assert log.read_text() == ""
+    assert json.loads((tmp_path / "analytics.json").read_text())["questions_count"] == 2
+
+    fresh_store.delete_document(doc.doc_id)
+    assert fresh_store.get_analytics()["top_documents"] == []
+    reloaded = importlib.reload(fresh_store)
+    stats = reloaded.get_stats()
+    assert (stats["total_questions"], stats["total_feedback"]) == (2, 1)
+    assert reloaded.get_analytics()["top_documents"] == []
+    assert reloaded._citations == {}
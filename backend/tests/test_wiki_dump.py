@@ -0,0 +1,140 @@
+import json
+
+from app import wiki_dump
+
+
+XML_DUMP = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/">
+  <page>
+    <title>Photosynthesis</title>
+    <ns>0</ns>
+    <revision><text>'''Photosynthesis''' is used by [[plant|plants]].{{cite web|url=x}}
+== Overview ==
+Light energy becomes [[chemical energy]].<ref>Source</ref></text></revision>
+  </page>
+  <page>
+    <title>Photo synthesis</title>
+    <ns>0</ns>
+    <redirect title="Photosynthesis" />
+    <revision><text>#REDIRECT [[Photosynthesis]]</text></revision>
+  </page>
+  <page>
+    <title>Talk:Photosynthesis</title>
+    <ns>1</ns>
+    <revision><text>Discussion</text></revision>
+  </page>
+  <page>
+    <title>Mitochondrion</title>
+    <ns>0</ns>
+    <revision><text>The [[mitochondrion]] is the powerhouse of the cell.</text></revision>
+  </page>
+</mediawiki>
+"""
+
+
+async def fake_embed(texts):
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_strip_wiki_markup():
+    text = (
+        "'''Bold''' intro with [[Target|label]] and [[Plain]].{{Infobox|a={{nested}}}}\n"
+        "== Heading ==\n"
+        "[[File:Leaf.png|thumb|A [[leaf]]]]Body<ref name=\"a\">cite</ref> [https://example.org site]"
+    )
+    result = wiki_dump.strip_wiki_markup(text)
+    assert result == "Bold intro with label and Plain.\nHeading\nBody site"
+
+
+def test_iter_xml_pages_skips_redirects_and_other_namespaces(tmp_path):
+    dump = tmp_path / "dump.xml"
+    dump.write_text(XML_DUMP, encoding="utf-8")
+
+    pages = list(wiki_dump.iter_dump_pages(dump))
+
+    assert [p.title for p in pages] == ["Photosynthesis", "Mitochondrion"]
+    assert pages[0].url == "https://en.wikipedia.org/wiki/Photosynthesis"
+
+
+def test_ingest_dump_tags_wikipedia_and_flushes_once_at_the_end(tmp_path, fresh_store, store_flushes):
+    dump = tmp_path / "dump.xml"
+    dump.write_text(XML_DUMP, encoding="utf-8")
+
+    pages, chunks = wiki_dump.ingest_dump(dump, embedder=fake_embed, batch_pages=1)
+
+    assert (pages, chunks) == (2, 2)
+    assert len(store_flushes) == 1
+    docs = fresh_store.get_docs(source="wikipedia")
+    assert {d.title for d in docs} == {"Photosynthesis", "Mitochondrion"}
+    assert all(d.url and d.url.startswith("https://en.wikipedia.org/wiki/") for d in docs)
+    assert "{{" not in docs[0].text and "[[" not in docs[0].text
+
+
+def test_ingest_dump_with_worker_processes_commits_in_dump_order(tmp_path, fresh_store):
+    dump = tmp_path / "dump.jsonl"
+    dump.write_text(
+        "\n".join(json.dumps({"title": f"Article {i}", "text": f"Body {i}"}) for i in range(6)),
+        encoding="utf-8",
+    )
+
+    result = wiki_dump.ingest_dump(dump, embedder=fake_embed, workers=2, batch_pages=2)
+
+    assert result == (6, 6)
+    assert [d.title for d in fresh_store.get_docs()] == [f"Article {i}" for i in range(6)]
+    assert all(d.embedding == [float(len(d.text)), 1.0] for d in fresh_store.get_docs())
+
+
+def test_ingest_dump_resumes_from_checkpoint(tmp_path, fresh_store):
+    dump = tmp_path / "dump.jsonl"
+    dump.write_text(
+        "\n".join(json.dumps({"title": f"Article {i}", "text": f"Body {i}"}) for i in range(5)),
+        encoding="utf-8",
+    )
+    checkpoint = tmp_path / "ckpt.json"
+
+    first = wiki_dump.ingest_dump(dump, embedder=fake_embed, batch_pages=2, checkpoint=checkpoint, limit=3)
+    second = wiki_dump.ingest_dump(dump, embedder=fake_embed, batch_pages=2, checkpoint=checkpoint)
+
+    assert first == (3, 3)
+    assert second == (2, 2)
+    assert json.loads(checkpoint.read_text())["pages_done"] == 5
+    titles = [d.title for d in fresh_store.get_docs()]
+    assert titles == [f"Article {i}" for i in range(5)]
+
+
+def test_checkpoint_only_advances_after_a_store_write(tmp_path, fresh_store, monkeypatch):
+    dump = tmp_path / "dump.jsonl"
+    dump.write_text(
+        "\n".join(json.dumps({"title": f"Article {i}", "text": f"Body {i}"}) for i in range(5)),
+        encoding="utf-8",
+    )
+    checkpoint = tmp_path / "ckpt.json"
+    seen = []
+    original_save = fresh_store._save_state
+
+    def save_and_record():
+        original_save()
+        saved = json.loads(fresh_store.DATA_PATH.read_text())["doc_chunks"]
+        done = json.loads(checkpoint.read_text())["pages_done"] if checkpoint.exists() else 0
+        seen.append((len(saved), done))
+
+    monkeypatch.setattr(fresh_store, "_save_state", save_and_record)
+    wiki_dump.ingest_dump(dump, embedder=fake_embed, batch_pages=1, checkpoint=checkpoint, flush_every=2)
+
+    # Writes after pages 2, 4 and at the end; each checkpoint lags its write.
+    assert seen == [(2, 0), (4, 2), (5, 4)]
+    assert json.loads(checkpoint.read_text())["pages_done"] == 5
+
+
+def test_reingesting_a_dump_replaces_articles_instead_of_duplicating(tmp_path, fresh_store):
+    dump = tmp_path / "dump.xml"
+    dump.write_text(XML_DUMP, encoding="utf-8")
+
+    wiki_dump.ingest_dump(dump, embedder=fake_embed)
+    first_ids = {d.doc_id for d in fresh_store.get_docs()}
+    dump.write_text(XML_DUMP.replace("powerhouse", "power plant"), encoding="utf-8")
+    wiki_dump.ingest_dump(dump, embedder=fake_embed)
+
+    docs = fresh_store.get_docs()
+    assert len(docs) == 2
+    assert {d.doc_id for d in docs} == first_ids
+    assert any("power plant" in d.text for d in docs)
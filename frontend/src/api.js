@@ -17,6 +17,9 @@ const buildError = async (response) => {
   throw new Error(message);
 };
 
+const collectionQuery = (collection) =>
+  collection ? `?collection=${encodeURIComponent(collection)}` : '';
+
 export const api = {
   async uploadText(title, text, source = 'user') {
     const response = await fetch(`${API_BASE_URL}/api/upload-text`, {
@@ -48,6 +51,38 @@ export const api = {
     return response.json();
   },
 
+  async listDocuments(collection = null) {
+    const response = await fetch(`${API_BASE_URL}/api/documents${collectionQuery(collection)}`);
+    if (!response.ok) {
+      await buildError(response);
+    }
+    return response.json();
+  },
+
+  async updateDocument(docId, title, text, source = 'user', collection = null) {
+    const response = await fetch(`${API_BASE_URL}/api/documents/${docId}${collectionQuery(collection)}`, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ title, text, source }),
+    });
+    if (!response.ok) {
+      await buildError(response);
+    }
+    return response.json();
+  },
+
+  async deleteDocument(docId, collection = null) {
+    const response = await fetch(`${API_BASE_URL}/api/documents/${docId}${collectionQuery(collection)}`, {
+      method: 'DELETE',
+    });
+    if (!response.ok) {
+      await buildError(response);
+    }
+    return response.json();
+  },
+
   async importWiki(query) {
     const response = await fetch(`${API_BASE_URL}/api/import-wiki`, {
       method: 'POST',
@@ -62,13 +97,29 @@ export const api = {
     return response.json();
   },
 
-  async chat(question, topK = 3, sources = null) {
+  async chat(question, topK = 3, sources = null, collection = null, sessionId = null) {
     const response = await fetch(`${API_BASE_URL}/api/chat`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ question, top_k: topK, sources }),
+      body: JSON.stringify({
+        question,
+        top_k: topK,
+        sources,
+        collection,
+        session_id: sessionId,
+      }),
+    });
+    if (!response.ok) {
+      await buildError(response);
+    }
+    return response.json();
+  },
+
+  async endSession(sessionId) {
+    const response = await fetch(`${API_BASE_URL}/api/sessions/${sessionId}`, {
+      method: 'DELETE',
     });
     if (!response.ok) {
       await buildError(response);
@@ -97,5 +148,13 @@ export const api = {
     }
     return response.json();
   },
+
+  async getAnalytics() {
+    const response = await fetch(`${API_BASE_URL}/api/analytics`);
+    if (!response.ok) {
+      await buildError(response);
+    }
+    return response.json();
+  },
 };
 
@@ -9,6 +9,8 @@ function Chat() {
   const [loading, setLoading] = useState(false)
   const [response, setResponse] = useState(null)
   const [error, setError] = useState('')
+  // Follow-up questions share a server-side session so earlier context is reused
+  const [sessionId, setSessionId] = useState(() => crypto.randomUUID())
 
   const handleSubmit = async (e) => {
     e.preventDefault()
@@ -25,7 +27,9 @@ function Chat() {
       const result = await api.chat(
         question,
         topK,
-        sources.length > 0 ? sources : null
+        sources.length > 0 ? sources : null,
+        null,
+        sessionId
       )
       setResponse(result)
     } catch (err) {
@@ -35,6 +39,13 @@ function Chat() {
     }
   }
 
+  const handleNewConversation = () => {
+    api.endSession(sessionId).catch(() => {})
+    setSessionId(crypto.randomUUID())
+    setResponse(null)
+    setQuestion('')
+  }
+
   const handleSourceToggle = (source) => {
     setSources((prev) =>
       prev.includes(source)
@@ -118,6 +129,14 @@ function Chat() {
         <button type="submit" disabled={loading} className="submit-btn">
           {loading ? 'Thinking...' : 'Ask Question'}
         </button>
+        <button
+          type="button"
+          onClick={handleNewConversation}
+          disabled={loading}
+          className="submit-btn"
+        >
+          New Conversation
+        </button>
       </form>
 
       {error && <div className="message error">{error}</div>}